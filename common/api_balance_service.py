@@ -5,26 +5,63 @@ API余额监控服务
 支持硅基流动API余额查询和监控
 """
 
-import json
+import atexit
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 import requests
-from datetime import datetime
-from typing import Optional, Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, List
+from common import json_utils
 from common.log import logger
 
 
+# 用于并发执行互不依赖的网络请求（如验证新KEY的同时预检NOFX服务）
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="api_balance")
+
+
 class APIBalanceService:
+    # 余额查询结果的默认缓存时间（秒），余额变化较慢，短时间内重复查询直接走缓存
+    CACHE_TTL = 30
+    # 上游查询失败时，最多回退到多久以前的成功结果（秒），更旧的结果不再当作当前余额展示
+    STALE_MAX_AGE = 10 * CACHE_TTL
+    # 余额查询产生的数据变更最多每隔多少秒落盘一次
+    SAVE_INTERVAL = 5.0
+    # 保留的历史记录条数
+    HISTORY_LIMIT = 50
+    # (连接超时, 读取超时)，连接阶段卡住时尽快失败并重试
+    TIMEOUT = (2, 8)
+
     def __init__(self, data_file: str = "api_balance_data.json"):
         self.data_file = data_file
         self.api_url = "https://api.siliconflow.cn/v1/user/info"
+        # 复用连接池，保持 keep-alive，避免每次查询都重新建立 TCP/TLS 连接
+        self._session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504],
+                      allowed_methods={"GET", "POST"}, raise_on_status=False)
+        self._session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry))
+        self._session.headers.update({"Content-Type": "application/json"})
+        # 每个API KEY对应的鉴权请求头，首次使用时构建后复用
+        self._auth_headers: Dict[str, Dict[str, str]] = {}
+        # 查询结果缓存: {api_key: (result, monotonic_time)}
+        self._cache: Dict[str, tuple] = {}
+        self._dirty = False
+        self._last_flush = 0.0
         self._load_data()
+        # 进程退出前写回尚未落盘的数据
+        atexit.register(self._flush)
     
     def _load_data(self):
         """加载存储的数据"""
         if os.path.exists(self.data_file):
             try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    self.data = json.load(f)
+                with open(self.data_file, 'rb') as f:
+                    self.data = json_utils.loads(f.read())
+                self.data["history"] = deque(self.data.get("history") or [], maxlen=self.HISTORY_LIMIT)
             except Exception as e:
                 logger.error(f"[APIBalance] Failed to load data: {e}")
                 self.data = self._get_default_data()
@@ -39,20 +76,44 @@ class APIBalanceService:
             "last_balance": None,
             "last_check_time": None,
             "low_balance_notified": False,
-            "history": []
+            "history": deque(maxlen=self.HISTORY_LIMIT)
         }
     
     def _save_data(self):
-        """保存数据到文件"""
+        """保存数据到文件（先写临时文件再替换，避免写到一半的文件）"""
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            tmp_file = f"{self.data_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(json_utils.dumps_bytes({**self.data, "history": list(self.data["history"])}))
+            os.replace(tmp_file, self.data_file)
+            self._dirty = False
+            self._last_flush = time.monotonic()
         except Exception as e:
             logger.error(f"[APIBalance] Failed to save data: {e}")
     
-    def query_balance(self, api_key: Optional[str] = None) -> Dict[str, Any]:
+    def _mark_dirty(self):
+        """标记数据已变更，距上次落盘超过 SAVE_INTERVAL 时才真正写文件"""
+        self._dirty = True
+        if time.monotonic() - self._last_flush > self.SAVE_INTERVAL:
+            self._save_data()
+    
+    def _recent_history(self, n: int) -> List[Dict[str, Any]]:
+        """获取最近 n 条历史记录（按时间正序）"""
+        recent = list(islice(reversed(self.data["history"]), n))
+        recent.reverse()
+        return recent
+    
+    def _flush(self):
+        """写回尚未落盘的数据"""
+        if self._dirty:
+            self._save_data()
+    
+    def query_balance(self, api_key: Optional[str] = None, max_age: float = CACHE_TTL) -> Dict[str, Any]:
         """
         查询API余额
+        :param api_key: 要查询的API KEY，默认使用当前KEY
+        :param max_age: 缓存有效期（秒），缓存未过期时直接返回缓存结果；
+                        0 表示强制查询（如校验新 KEY），查询失败时直接返回错误，不回退到缓存
         返回格式: {
             "success": bool,
             "balance": float,
@@ -63,38 +124,51 @@ class APIBalanceService:
         if not api_key:
             api_key = self.data["current_api_key"]
         
+        cached = self._cache.get(api_key)
+        if cached and max_age > 0 and time.monotonic() - cached[1] < max_age:
+            return cached[0]
+        
+        result = self._request_balance(api_key)
+        if result["success"]:
+            self._cache[api_key] = (result, time.monotonic())
+        elif cached and max_age > 0 and time.monotonic() - cached[1] < self.STALE_MAX_AGE:
+            # 上游查询失败时回退到最近一次成功的结果（不超过 STALE_MAX_AGE）
+            logger.warning(f"[APIBalance] Query failed, fallback to cached balance from {cached[0]['check_time']}")
+            return cached[0]
+        return result
+    
+    def _request_balance(self, api_key: str) -> Dict[str, Any]:
+        """请求硅基流动API查询余额，并更新本地数据"""
         try:
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
+            headers = self._auth_headers.get(api_key)
+            if headers is None:
+                headers = self._auth_headers[api_key] = {"Authorization": f"Bearer {api_key}"}
             
-            response = requests.get(self.api_url, headers=headers, timeout=10)
+            response = self._session.get(self.api_url, headers=headers, timeout=self.TIMEOUT)
             
             if response.status_code == 200:
-                result = response.json()
+                result = json_utils.loads(response.content)
                 # 硅基流动API返回格式: {"data": {"balance": 123.45}}
                 balance = float(result.get("data", {}).get("balance", 0))
                 
                 # 更新数据
-                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                # 直接格式化本地时间，无需构造 datetime 对象
+                now = time.strftime("%Y-%m-%d %H:%M:%S")
                 self.data["last_balance"] = balance
                 self.data["last_check_time"] = now
                 
-                # 添加历史记录（保留最近50条）
+                # 添加历史记录（deque 自动只保留最近 HISTORY_LIMIT 条）
                 self.data["history"].append({
                     "time": now,
                     "balance": balance,
                     "api_key_suffix": api_key[-8:] if len(api_key) > 8 else api_key
                 })
-                if len(self.data["history"]) > 50:
-                    self.data["history"] = self.data["history"][-50:]
                 
                 # 检查是否需要重置低余额通知标志
                 if balance >= 0.5:
                     self.data["low_balance_notified"] = False
                 
-                self._save_data()
+                self._mark_dirty()
                 
                 return {
                     "success": True,
@@ -127,7 +201,7 @@ class APIBalanceService:
         检查余额并返回通知消息（如果需要）
         返回: 通知消息字符串，如果不需要通知则返回None
         """
-        result = self.query_balance()
+        result = self.query_balance(max_age=60)
         
         if not result["success"]:
             return None
@@ -152,34 +226,37 @@ class APIBalanceService:
             "balance": float (可选)
         }
         """
-        # 先验证新的API KEY是否有效
-        result = self.query_balance(new_api_key)
+        # 验证新KEY的同时在后台预检NOFX服务（健康检查 + 登录），三者互不依赖
+        nofx_probe = self._start_nofx_probe()
+        
+        # 验证新的API KEY是否有效
+        result = self.query_balance(new_api_key, max_age=0)
         
         if result["success"]:
             self.data["current_api_key"] = new_api_key
             self.data["low_balance_notified"] = False
             self._save_data()
             
-            message = f"✅ API KEY已更新\n当前余额: ¥{result['balance']:.2f}"
+            parts = ["✅ API KEY已更新", f"当前余额: ¥{result['balance']:.2f}", ""]
             
             # 自动同步到NOFX交易系统（热更新，不中断交易）
-            nofx_result = self._sync_to_nofx_hot_update(new_api_key)
+            nofx_result = self._sync_to_nofx_hot_update(new_api_key, nofx_probe)
             
             if nofx_result["success"]:
-                message += f"\n\n✅ NOFX交易系统已同步更新"
+                parts.append("✅ NOFX交易系统已同步更新")
                 if nofx_result.get("affected_models", 0) > 0:
-                    message += f"\n🤖 已更新 {nofx_result['affected_models']} 个AI模型"
+                    parts.append(f"🤖 已更新 {nofx_result['affected_models']} 个AI模型")
                 if nofx_result.get("affected_traders", 0) > 0:
-                    message += f"\n📊 影响 {nofx_result['affected_traders']} 个交易员"
+                    parts.append(f"📊 影响 {nofx_result['affected_traders']} 个交易员")
                     if nofx_result.get("running_traders", 0) > 0:
-                        message += f"\n🔄 {nofx_result['running_traders']} 个正在运行（无需重启）"
+                        parts.append(f"🔄 {nofx_result['running_traders']} 个正在运行（无需重启）")
             else:
-                message += f"\n\n⚠️ NOFX同步失败: {nofx_result['message']}"
-                message += "\n💡 请手动更新: http://47.109.82.94:3000"
+                parts.append(f"⚠️ NOFX同步失败: {nofx_result['message']}")
+                parts.append("💡 请手动更新: http://47.109.82.94:3000")
             
             return {
                 "success": True,
-                "message": message,
+                "message": "\n".join(parts),
                 "balance": result["balance"],
                 "nofx_synced": nofx_result["success"]
             }
@@ -189,10 +266,25 @@ class APIBalanceService:
                 "message": f"❌ API KEY验证失败\n{result.get('error', '未知错误')}"
             }
     
-    def _sync_to_nofx_hot_update(self, api_key: str) -> Dict[str, Any]:
+    def _start_nofx_probe(self) -> Optional[tuple]:
+        """
+        在后台并发执行NOFX健康检查和登录
+        返回: (health_future, login_future)，启动失败返回None
+        """
+        try:
+            from common.nofx_api_service import get_nofx_service
+            
+            nofx_service = get_nofx_service()
+            return _executor.submit(nofx_service.get_health), _executor.submit(nofx_service.ensure_login)
+        except Exception as e:
+            logger.warning(f"[APIBalance] Failed to start NOFX probe: {e}")
+            return None
+    
+    def _sync_to_nofx_hot_update(self, api_key: str, probe: Optional[tuple] = None) -> Dict[str, Any]:
         """
         热更新NOFX交易系统的API KEY（不中断交易）
         使用新的 /api/models/update-keys 接口
+        :param probe: _start_nofx_probe 的返回值，提供时直接复用其健康检查和登录结果
         """
         try:
             from common.nofx_api_service import get_nofx_service
@@ -200,7 +292,13 @@ class APIBalanceService:
             nofx_service = get_nofx_service()
             
             # 检查NOFX服务是否运行
-            if not nofx_service.get_health():
+            if probe:
+                healthy = probe[0].result()
+                # 等待后台登录完成，update_models_keys 直接复用 token
+                probe[1].result()
+            else:
+                healthy = nofx_service.get_health()
+            if not healthy:
                 logger.warning("[APIBalance] NOFX service is not running")
                 return {
                     "success": False,
@@ -228,9 +326,7 @@ class APIBalanceService:
                 }
                 
         except Exception as e:
-            logger.error(f"[APIBalance] NOFX hot update failed: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception(f"[APIBalance] NOFX hot update failed: {e}")
             return {
                 "success": False,
                 "message": f"热更新失败: {str(e)}"
@@ -251,26 +347,30 @@ class APIBalanceService:
         api_key_suffix = self.data["current_api_key"][-8:]
         
         # 构建消息
-        msg = f"💰 API余额查询\n\n"
-        msg += f"当前余额: ¥{balance:.2f}\n"
-        msg += f"API KEY: ...{api_key_suffix}\n"
-        msg += f"查询时间: {check_time}\n"
+        parts = [
+            "💰 API余额查询",
+            "",
+            f"当前余额: ¥{balance:.2f}",
+            f"API KEY: ...{api_key_suffix}",
+            f"查询时间: {check_time}",
+            "",
+        ]
         
         # 添加状态提示
         if balance < 0.5:
-            msg += f"\n⚠️ 余额不足0.5元，请及时充值"
+            parts.append("⚠️ 余额不足0.5元，请及时充值")
         elif balance < 5.0:
-            msg += f"\n💡 余额较低，建议充值"
+            parts.append("💡 余额较低，建议充值")
         else:
-            msg += f"\n✅ 余额充足"
+            parts.append("✅ 余额充足")
         
         # 添加最近3条历史记录
         if len(self.data["history"]) > 1:
-            msg += f"\n\n📊 最近记录:"
-            for record in self.data["history"][-3:]:
-                msg += f"\n{record['time']}: ¥{record['balance']:.2f}"
+            parts.append("")
+            parts.append("📊 最近记录:")
+            parts.extend(f"{record['time']}: ¥{record['balance']:.2f}" for record in self._recent_history(3))
         
-        return msg
+        return "\n".join(parts)
     
     def get_current_api_key(self) -> str:
         """获取当前API KEY"""
@@ -281,7 +381,7 @@ class APIBalanceService:
         获取用于Web展示的余额信息
         """
         if not self.data["last_balance"] or not self.data["last_check_time"]:
-            result = self.query_balance()
+            result = self.query_balance(max_age=10)
             if not result["success"]:
                 return {
                     "balance": 0,
@@ -305,17 +405,11 @@ class APIBalanceService:
             "check_time": self.data["last_check_time"],
             "status": status,
             "api_key_suffix": self.data["current_api_key"][-8:],
-            "history": self.data["history"][-10:]  # 最近10条记录
+            "history": self._recent_history(10)  # 最近10条记录
         }
 
 
-# 全局实例
-_balance_service = None
-
-
+@lru_cache(maxsize=None)
 def get_balance_service() -> APIBalanceService:
     """获取全局余额服务实例"""
-    global _balance_service
-    if _balance_service is None:
-        _balance_service = APIBalanceService()
-    return _balance_service
+    return APIBalanceService()
@@ -4,6 +4,7 @@ import threading
 from typing import Generator
 
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, scoped_session
 
 from config import conf
@@ -18,6 +19,18 @@ _SessionFactory = None
 _scoped = None
 _lock = threading.Lock()
 
+_async_engine = None
+_AsyncSessionFactory = None
+
+# 同步驱动 -> 对应的异步驱动，用于从 db_url 推导异步连接串
+_ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
 
 def _ensure_engine():
     global _engine, _SessionFactory, _scoped
@@ -27,17 +40,68 @@ def _ensure_engine():
                 db_url = conf().get("db_url")
                 if not db_url:
                     raise RuntimeError("db_url not configured in config.json")
-                _engine = create_engine(db_url, pool_pre_ping=True, future=True)
-                _SessionFactory = sessionmaker(bind=_engine, autoflush=False, autocommit=False, future=True)
-                _scoped = scoped_session(_SessionFactory)
+                # 默认用 pool_recycle 定时回收空闲连接，代替每次取连接都 SELECT 1 的 pool_pre_ping
+                engine_kwargs = {
+                    "pool_pre_ping": conf().get("db_pool_pre_ping", False),
+                    "pool_recycle": 1800,
+                    "future": True,
+                }
+                if not db_url.startswith("sqlite"):
+                    # 显式指定 QueuePool：调度线程、API 服务与消息处理共用同一个引擎，
+                    # 必须复用连接，不能退化为每次新建连接的 NullPool
+                    engine_kwargs.update(poolclass=QueuePool, pool_size=10, max_overflow=20)
+                engine = create_engine(db_url, **engine_kwargs)
+                # expire_on_commit=False：提交后不过期已加载的属性，避免之后访问时再查一次库
+                _SessionFactory = sessionmaker(
+                    bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True
+                )
                 _scoped = scoped_session(_SessionFactory)
+                # 最后再发布 _engine：其他线程在锁外看到 _engine 非空时，_scoped 一定已就绪
+                _engine = engine
 
 
 def get_session():
+    """获取当前线程的会话，底层连接来自引擎的连接池（非 sqlite 为 QueuePool）"""
     _ensure_engine()
     return _scoped()
 
 
+def _async_db_url() -> str:
+    db_url = conf().get("db_async_url")
+    if db_url:
+        return db_url
+    db_url = conf().get("db_url")
+    if not db_url:
+        raise RuntimeError("db_url not configured in config.json")
+    scheme, sep, rest = db_url.partition("://")
+    return _ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def _ensure_async_engine():
+    global _async_engine, _AsyncSessionFactory
+    if _async_engine is None:
+        with _lock:
+            if _async_engine is None:
+                if not conf().get("db_async", False):
+                    raise RuntimeError("async db session is disabled, set db_async to true in config.json")
+                # 异步扩展依赖 greenlet 和异步驱动，仅在开启时导入
+                from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+                engine = create_async_engine(
+                    _async_db_url(), pool_pre_ping=conf().get("db_pool_pre_ping", False), pool_recycle=1800
+                )
+                _AsyncSessionFactory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+                _async_engine = engine
+
+
+def get_async_session():
+    """获取异步会话（需在 config.json 中开启 db_async）
+    用法: async with get_async_session() as s: ...
+    """
+    _ensure_async_engine()
+    return _AsyncSessionFactory()
+
+
 def init_db():
     _ensure_engine()
     from common.models import Base as ModelsBase
@@ -0,0 +1,36 @@
+# encoding:utf-8
+
+"""
+JSON 序列化工具
+优先使用 orjson（C 实现，解析和序列化更快），未安装时回退到标准库 json
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """反序列化 JSON，支持 str / bytes / bytearray / memoryview"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps_bytes(obj) -> bytes:
+    """序列化为紧凑的 UTF-8 JSON 字节串（不转义中文）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    """序列化为紧凑的 JSON 字符串（不转义中文）"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
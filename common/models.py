@@ -3,7 +3,8 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, Integer, DateTime, ForeignKey, Numeric, Text, Boolean, Index
+from sqlalchemy import String, Integer, DateTime, ForeignKey, Text, Boolean, Index, text
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from common.db import Base
@@ -24,12 +25,12 @@ class Expense(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
-    amount: Mapped[Numeric] = mapped_column(Numeric(10, 2))
+    amount: Mapped[int] = mapped_column(Integer)  # 金额，单位：分
     currency: Mapped[str] = mapped_column(String(8), default="CNY")
     category: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
     merchant: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     note: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
-    spent_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    spent_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     source_msg_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
     image_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     ocr_text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
@@ -37,8 +38,14 @@ class Expense(Base):
 
     user: Mapped[User] = relationship(backref="expenses")
 
+    @hybrid_property
+    def amount_yuan(self) -> float:
+        """金额，单位：元"""
+        return self.amount / 100.0
+
     __table_args__ = (
-        Index("idx_expenses_user_spent", "user_id", "spent_at"),
+        # 按时间倒序查看最近记录是主要访问方式，单独的 spent_at 索引已被该复合索引覆盖
+        Index("idx_expenses_user_spent_desc", "user_id", text("spent_at DESC")),
         Index("idx_expenses_user_cat", "user_id", "category"),
     )
 
@@ -62,4 +69,16 @@ class Todo(Base):
 
     user: Mapped[User] = relationship(backref="todos")
 
+    __table_args__ = (
+        # 调度器每分钟按 status='pending' AND reminded=False AND remind_at<=now 查询到期提醒，
+        # 复合索引让该查询走索引范围扫描
+        Index("idx_todos_due", "status", "reminded", "remind_at"),
+        # 重复提醒：status='pending' AND remind_count<3 AND last_remind_at<=now-10min
+        Index("idx_todos_due_repeat", "status", "remind_count", "last_remind_at"),
+        # 按用户查看某天的待提醒待办，按 remind_at 排序
+        Index("idx_todos_user_remind", "user_id", "status", "remind_at"),
+        # 回复数字快捷完成 / #todo done：按用户查找最近被提醒的 pending/failed 待办
+        Index("idx_todos_user_last_remind", "user_id", "status", "last_remind_at"),
+    )
+
 
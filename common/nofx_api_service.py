@@ -6,25 +6,86 @@ NOFX交易系统API服务
 用于热更新API密钥，不中断交易
 """
 
+import os
+import threading
+import time
+from functools import lru_cache
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, Any, Optional
+from common import json_utils
 from common.log import logger
 
 
 class NofxAPIService:
-    def __init__(self, base_url: str = "http://47.109.82.94", port: int = 80):
+    # JWT Token 复用时长（秒），保守地早于服务端过期时间
+    TOKEN_TTL = 3000
+    # (连接超时, 读取超时)，连接阶段卡住时尽快失败并重试
+    TIMEOUT = (2, 8)
+
+    def __init__(self, base_url: str = "http://47.109.82.94", port: int = 80,
+                 token_file: str = "nofx_token.json"):
         self.base_url = f"{base_url}:{port}" if port != 80 else base_url
         self.api_url = f"{self.base_url}/api"
+        # 接口地址在初始化时拼接一次，避免每次调用重复格式化
+        self._url_login = f"{self.api_url}/login"
+        self._url_update_keys = f"{self.api_url}/models/update-keys"
+        self._url_health = f"{self.api_url}/health"
+        self._url_exchanges = f"{self.api_url}/exchanges"
         self.token = None
         self.email = None
         self.password = None
+        self.token_file = token_file
+        self._token_ts = 0.0
+        self._token_lock = threading.Lock()
+        # 复用连接池，保持 keep-alive，避免每次调用都重新建立 TCP 连接
+        self._session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504],
+                      allowed_methods={"GET", "POST"}, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
     
     def set_credentials(self, email: str, password: str):
         """设置登录凭证"""
         self.email = email
         self.password = password
     
+    def _set_token(self, token: str, ts: float):
+        self.token = token
+        self._token_ts = ts
+        # Token 设置为 Session 默认请求头，后续请求无需再构建
+        self._session.headers["Authorization"] = f"Bearer {token}"
+    
+    def _token_valid(self) -> bool:
+        return bool(self.token) and time.time() - self._token_ts < self.TOKEN_TTL
+    
+    def _load_token(self):
+        """从文件加载上次登录缓存的Token（仅限同一账号且未过期）"""
+        try:
+            if not os.path.exists(self.token_file):
+                return
+            with open(self.token_file, 'rb') as f:
+                cached = json_utils.loads(f.read())
+            if cached.get("email") != self.email or not cached.get("token"):
+                return
+            if time.time() - float(cached.get("ts", 0)) < self.TOKEN_TTL:
+                self._set_token(cached["token"], float(cached["ts"]))
+                logger.info("[NofxAPI] Reuse cached token")
+        except Exception as e:
+            logger.warning(f"[NofxAPI] Failed to load cached token: {e}")
+    
+    def _save_token(self):
+        """持久化Token，进程重启后可直接复用"""
+        try:
+            tmp_file = f"{self.token_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(json_utils.dumps_bytes({"email": self.email, "token": self.token, "ts": self._token_ts}))
+            os.replace(tmp_file, self.token_file)
+        except Exception as e:
+            logger.warning(f"[NofxAPI] Failed to save token: {e}")
+    
     def login(self) -> bool:
         """登录获取JWT Token"""
         try:
@@ -32,18 +93,21 @@ class NofxAPIService:
                 logger.warning("[NofxAPI] No credentials set")
                 return False
             
-            url = f"{self.api_url}/login"
+            url = self._url_login
             data = {
                 "email": self.email,
                 "password": self.password
             }
             
-            response = requests.post(url, json=data, timeout=10)
+            response = self._session.post(url, json=data, timeout=self.TIMEOUT)
             
             if response.status_code == 200:
-                result = response.json()
-                self.token = result.get("token")
-                if self.token:
+                result = json_utils.loads(response.content)
+                token = result.get("token")
+                if token:
+                    with self._token_lock:
+                        self._set_token(token, time.time())
+                        self._save_token()
                     logger.info("[NofxAPI] Login successful")
                     return True
             
@@ -54,6 +118,16 @@ class NofxAPIService:
             logger.error(f"[NofxAPI] Login error: {e}")
             return False
     
+    def ensure_login(self) -> bool:
+        """确保已登录，Token未过期时直接返回（优先复用内存和文件中的缓存）"""
+        if self._token_valid():
+            return True
+        with self._token_lock:
+            self._load_token()
+        if self._token_valid():
+            return True
+        return self.login()
+    
     def update_exchange_keys(self, exchange_id: str, api_key: str, secret_key: str = "") -> Dict[str, Any]:
         """
         热更新交易所API密钥（不中断交易）
@@ -82,27 +156,22 @@ class NofxAPIService:
         """
         try:
             # 确保已登录
-            if not self.token:
-                if not self.login():
-                    return {
-                        "success": False,
-                        "message": "登录失败，无法更新NOFX"
-                    }
+            if not self.ensure_login():
+                return {
+                    "success": False,
+                    "message": "登录失败，无法更新NOFX"
+                }
             
-            url = f"{self.api_url}/models/update-keys"
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json"
-            }
+            url = self._url_update_keys
             data = {
                 "api_key": api_key
             }
             
             logger.info(f"[NofxAPI] Calling /api/models/update-keys with api_key: {api_key[:10]}...")
-            response = requests.post(url, json=data, headers=headers, timeout=10)
+            response = self._session.post(url, json=data, timeout=self.TIMEOUT)
             
             if response.status_code == 200:
-                result = response.json()
+                result = json_utils.loads(response.content)
                 logger.info(f"[NofxAPI] Models keys updated: {result.get('message')}")
                 return {
                     "success": True,
@@ -132,9 +201,7 @@ class NofxAPIService:
                 }
                 
         except Exception as e:
-            logger.error(f"[NofxAPI] Update error: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception(f"[NofxAPI] Update error: {e}")
             return {
                 "success": False,
                 "message": f"更新异常: {str(e)}"
@@ -143,8 +210,8 @@ class NofxAPIService:
     def get_health(self) -> bool:
         """检查NOFX服务健康状态"""
         try:
-            url = f"{self.api_url}/health"
-            response = requests.get(url, timeout=5)
+            url = self._url_health
+            response = self._session.get(url, timeout=self.TIMEOUT)
             return response.status_code == 200
         except Exception as e:
             logger.error(f"[NofxAPI] Health check failed: {e}")
@@ -153,17 +220,14 @@ class NofxAPIService:
     def get_exchanges(self) -> list:
         """获取交易所列表"""
         try:
-            if not self.token:
-                if not self.login():
-                    return []
-            
-            url = f"{self.api_url}/exchanges"
-            headers = {"Authorization": f"Bearer {self.token}"}
+            if not self.ensure_login():
+                return []
             
-            response = requests.get(url, headers=headers, timeout=10)
+            url = self._url_exchanges
+            response = self._session.get(url, timeout=self.TIMEOUT)
             
             if response.status_code == 200:
-                return response.json()
+                return json_utils.loads(response.content)
             
             return []
             
@@ -172,31 +236,26 @@ class NofxAPIService:
             return []
 
 
-# 全局实例
-_nofx_service = None
-
-
+@lru_cache(maxsize=None)
 def get_nofx_service() -> NofxAPIService:
     """获取全局NOFX服务实例"""
-    global _nofx_service
-    if _nofx_service is None:
-        _nofx_service = NofxAPIService()
+    nofx_service = NofxAPIService()
+    
+    # 从配置文件读取凭证
+    try:
+        from config import conf
+        nofx_config = conf().get("nofx", {})
+        email = nofx_config.get("email")
+        password = nofx_config.get("password")
         
-        # 从配置文件读取凭证
-        try:
-            from config import conf
-            nofx_config = conf().get("nofx", {})
-            email = nofx_config.get("email")
-            password = nofx_config.get("password")
+        if email and password:
+            nofx_service.set_credentials(email, password)
+            logger.info("[NofxAPI] Credentials loaded from config")
+        else:
+            logger.warning("[NofxAPI] No credentials in config, will use default")
+            # 使用默认凭证（需要在config.json中配置）
             
-            if email and password:
-                _nofx_service.set_credentials(email, password)
-                logger.info("[NofxAPI] Credentials loaded from config")
-            else:
-                logger.warning("[NofxAPI] No credentials in config, will use default")
-                # 使用默认凭证（需要在config.json中配置）
-                
-        except Exception as e:
-            logger.warning(f"[NofxAPI] Failed to load credentials: {e}")
+    except Exception as e:
+        logger.warning(f"[NofxAPI] Failed to load credentials: {e}")
     
-    return _nofx_service
+    return nofx_service
@@ -1,22 +1,71 @@
 # encoding:utf-8
 
+import logging
+import sched
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Callable
 
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import OperationalError
+
+from common.api_balance_service import get_balance_service
+from common.db import get_session
 from common.log import logger
-from common.service import fetch_due_reminders, mark_reminded, recover_failed_todos
+from common.models import Todo
+from common.service import (
+    fetch_due_reminders, fetch_next_due_at, mark_reminded_bulk, note_reminder_sent, recover_failed_todos,
+    todo_change_seq
+)
+from common.weather_service import send_daily_weather_batch
+from config import conf
 
 
 class ReminderScheduler:
+    # 到期提醒检查间隔（秒）
+    REMIND_INTERVAL = 30
+    # API余额检查间隔（秒）
+    BALANCE_INTERVAL = 1800
+    # 依据缓存的下次到期时间跳过查询的最长时长（秒）：API 服务在独立进程中写入待办，
+    # 本进程收不到变更通知，超过该时长后无论如何都重新查一次。
+    # 截止时间在本轮查询结束时计算，取两个检查间隔：每次查询后最多跳过一轮，
+    # Web 端新建/修改的提醒最多比逐轮查询晚一轮
+    NEXT_DUE_MAX_SKIP = 2 * REMIND_INTERVAL
+
     def __init__(self, send_func: Callable[[str, str], None]):
         # send_func(receiver_id, text)
         self._send = send_func
         self._stop = threading.Event()
         self._t = threading.Thread(target=self._run, daemon=True)
+        # 发送提醒是网络 I/O，用小线程池并发发送，批量到期时不必逐条等待
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="reminder-send")
+        # 各任务按自己的到期时间排队，使用单调时钟，不受系统时间调整影响
+        self._sched = sched.scheduler(time.monotonic, self._wait)
+        self._session = None
+        self._check_count = 0
+        self._db_retries = 0  # 连续数据库连接错误次数，用于退避重试
+        # 缓存的下次到期时间：在其之前、且待办无变更时跳过到期查询
+        self._next_due_at = None
+        self._next_due_seq = None  # 计算 _next_due_at 时的待办变更序号，None 表示未计算
+        self._next_due_deadline = 0.0  # 缓存失效的单调时钟时间点
+        self._last_weather_date = None  # 上次天气推送的日期
+        self._balance_service = None
+        # 配置在初始化时解析一次，避免循环中反复调用 conf().get(...)
+        self._weather_cfg = conf().get("weather", {}) or {}
+        # target_user 可配置为单个用户ID或用户ID列表
+        target_user = self._weather_cfg.get("target_user") or []
+        self._target_users = [target_user] if isinstance(target_user, str) else list(target_user)
+        self._openai_cfg = {
+            'api_key': conf().get("open_ai_api_key"),
+            'api_base': conf().get("open_ai_api_base"),
+            'model': conf().get("model", "gpt-3.5-turbo")
+        }
 
     def start(self):
+        # 余额服务是全局单例，启动时取一次，之后每次检查直接使用
+        self._balance_service = get_balance_service()
         # 启动前先修复提醒状态
         self._fix_reminder_status_on_startup()
         self._t.start()
@@ -24,68 +73,51 @@ class ReminderScheduler:
     def _fix_reminder_status_on_startup(self):
         """启动时修复提醒状态"""
         try:
-            from datetime import datetime, timedelta
-            from common.db import get_session
-            from common.models import Todo
-            from sqlalchemy import select, update
-            
             logger.info("[ReminderScheduler] Fixing reminder status on startup...")
             
             now = datetime.now()
             
-            with get_session() as s:
-                # 1. 重置已过期但 reminded=True 的非重复任务
-                result1 = s.execute(
-                    update(Todo).where(
-                        Todo.status == "pending",
-                        Todo.reminded == True,  # noqa: E712
-                        Todo.remind_at != None,  # noqa: E711
-                        Todo.remind_at < now,
-                        Todo.repeat_rule == None  # noqa: E711
-                    ).values(
-                        reminded=False,
-                        remind_count=0,
-                        last_remind_at=None
-                    )
-                )
-                count1 = result1.rowcount
-                
-                # 2. 重置重复任务的提醒状态
-                result2 = s.execute(
-                    update(Todo).where(
-                        Todo.status == "pending",
-                        Todo.reminded == True,  # noqa: E712
-                        Todo.remind_at != None,  # noqa: E711
-                        Todo.remind_at < now,
-                        Todo.repeat_rule != None  # noqa: E711
-                    ).values(
-                        reminded=False,
-                        remind_count=0,
-                        last_remind_at=None
-                    )
+            # 更新和统计放在同一个事务中，离开 begin() 时统一提交
+            with get_session() as s, s.begin():
+                # 1. 重置已过期但 reminded=True 的任务（重复和非重复任务一并处理）
+                stmt = update(Todo).where(
+                    Todo.status == "pending",
+                    Todo.reminded == True,  # noqa: E712
+                    Todo.remind_at != None,  # noqa: E711
+                    Todo.remind_at < now,
+                ).values(
+                    reminded=False,
+                    remind_count=0,
+                    last_remind_at=None
                 )
-                count2 = result2.rowcount
-                
-                s.commit()
+                # PostgreSQL / SQLite 3.35+ 支持 UPDATE ... RETURNING，一次往返拿到被修复的 id；
+                # MySQL 不支持，退回使用 rowcount
+                if s.bind.dialect.update_returning:
+                    fixed_ids = s.execute(stmt.returning(Todo.id)).scalars().all()
+                    total_fixed = len(fixed_ids)
+                else:
+                    fixed_ids = None
+                    total_fixed = s.execute(stmt).rowcount
                 
-                total_fixed = count1 + count2
                 if total_fixed > 0:
-                    logger.info(f"[ReminderScheduler] Fixed {total_fixed} reminder statuses (non-repeat: {count1}, repeat: {count2})")
+                    logger.info(f"[ReminderScheduler] Fixed {total_fixed} reminder statuses")
+                    if fixed_ids:
+                        logger.debug(f"[ReminderScheduler] Fixed todo ids: {fixed_ids}")
                 else:
                     logger.info("[ReminderScheduler] No reminder status needs fixing")
                 
-                # 3. 统计待提醒的待办
+                # 2. 统计待提醒的待办
                 pending_count = s.execute(
-                    select(Todo).where(
+                    select(func.count()).select_from(Todo).where(
                         Todo.status == "pending",
                         Todo.reminded == False,  # noqa: E712
                         Todo.remind_at != None,  # noqa: E711
                         Todo.remind_at <= now
                     )
-                ).scalars().all()
+                ).scalar()
                 
                 if pending_count:
-                    logger.info(f"[ReminderScheduler] Found {len(pending_count)} pending reminders to send")
+                    logger.info(f"[ReminderScheduler] Found {pending_count} pending reminders to send")
                 
         except Exception as e:
             logger.error(f"[ReminderScheduler] Failed to fix reminder status on startup: {e}")
@@ -93,37 +125,26 @@ class ReminderScheduler:
     def stop(self):
         self._stop.set()
         self._t.join(timeout=2)
+        self._pool.shutdown(wait=True)
 
     def _send_daily_weather(self):
         """发送每日天气"""
         try:
-            from config import conf
-            from common.weather_service import send_daily_weather
-            
-            weather_config = conf().get("weather", {})
-            if not weather_config:
+            if not self._weather_cfg:
                 return
             
-            amap_key = weather_config.get("amap_key")
-            target_user = weather_config.get("target_user")
+            amap_key = self._weather_cfg.get("amap_key")
             
-            if not amap_key or not target_user:
+            if not amap_key or not self._target_users:
                 logger.warning("[ReminderScheduler] Weather config not complete, skip daily weather")
                 return
             
-            # 准备OpenAI配置
-            openai_config = {
-                'api_key': conf().get("open_ai_api_key"),
-                'api_base': conf().get("open_ai_api_base"),
-                'model': conf().get("model", "gpt-3.5-turbo")
-            }
-            
-            # 发送天气
-            send_daily_weather(
+            # 发送天气（多个用户时消息只生成一次，并发发送）
+            send_daily_weather_batch(
                 self._send,
-                target_user,
+                self._target_users,
                 amap_key,
-                openai_config
+                self._openai_cfg
             )
             
         except Exception as e:
@@ -132,19 +153,13 @@ class ReminderScheduler:
     def _check_api_balance(self):
         """检查API余额"""
         try:
-            from common.api_balance_service import get_balance_service
-            from config import conf
-            
-            balance_service = get_balance_service()
-            notify_msg = balance_service.check_and_notify()
+            notify_msg = self._balance_service.check_and_notify()
             
             if notify_msg:
                 # 发送给配置的目标用户
-                weather_config = conf().get("weather", {})
-                target_user = weather_config.get("target_user")
-                
-                if target_user:
-                    self._send(target_user, notify_msg)
+                if self._target_users:
+                    for target_user in self._target_users:
+                        self._send(target_user, notify_msg)
                     logger.info("[ReminderScheduler] Sent API balance warning")
                 else:
                     logger.warning("[ReminderScheduler] No target user configured for API balance notification")
@@ -153,79 +168,149 @@ class ReminderScheduler:
             logger.error(f"[ReminderScheduler] Failed to check API balance: {e}")
     
     def _run(self):
-        logger.info("[ReminderScheduler] thread started, checking every 60s")
-        check_count = 0
-        last_recover_check = None  # 上次检查凌晨恢复的时间
-        last_weather_push = None  # 上次天气推送的日期
-        last_balance_check = None  # 上次余额检查的时间
-        
-        while not self._stop.is_set():
-            try:
-                check_count += 1
-                # 使用本地时间（与数据库中的 remind_at 一致）
-                now = datetime.now()
-                # 每10次检查输出一次日志，避免刷屏
-                if check_count % 10 == 1:
-                    logger.info(f"[ReminderScheduler] alive, checked {check_count} times, now: {now.strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # 每日天气推送（早上8点，每天只推送一次）
-                if now.hour == 8 and now.minute < 10:
-                    today_date = now.date()
-                    if last_weather_push != today_date:
-                        try:
-                            self._send_daily_weather()
-                            last_weather_push = today_date
-                            logger.info(f"[ReminderScheduler] Sent daily weather at {now.strftime('%H:%M:%S')}")
-                        except Exception as e:
-                            logger.warning(f"[ReminderScheduler] send daily weather error: {e}")
-                
-                # API余额检查（每30分钟检查一次）
-                if last_balance_check is None or (now - last_balance_check).total_seconds() >= 1800:
-                    try:
-                        self._check_api_balance()
-                        last_balance_check = now
-                        if check_count % 10 == 1:  # 每10次检查输出一次日志
-                            logger.info(f"[ReminderScheduler] Checked API balance at {now.strftime('%H:%M:%S')}")
-                    except Exception as e:
-                        logger.warning(f"[ReminderScheduler] check API balance error: {e}")
-                
-                # 凌晨恢复失败任务（每天只执行一次）
-                if now.hour == 0 and now.minute < 5:  # 凌晨0点-5分之间
-                    if last_recover_check is None or (now - last_recover_check).total_seconds() > 3600:
-                        try:
-                            count = recover_failed_todos()
-                            if count > 0:
-                                logger.info(f"[ReminderScheduler] recovered {count} failed todos at midnight")
-                            last_recover_check = now
-                        except Exception as e:
-                            logger.warning(f"[ReminderScheduler] recover failed todos error: {e}")
-                
-                # 检查需要提醒的待办
-                due = fetch_due_reminders(now)
-                if due:
-                    logger.info(f"[ReminderScheduler] found {len(due)} due reminders at {now.strftime('%H:%M:%S')}")
-                    for todo, user in due:
-                        try:
-                            msg = f"⏰ 提醒：{todo.title}"
-                            
-                            display_time = todo.remind_at or now
-                            # 对于重复提醒（remind_count>0），显示提醒时间 + 10 分钟 * 提醒次数
-                            if todo.remind_count and todo.remind_count > 0 and todo.remind_at:
-                                display_time = todo.remind_at + timedelta(minutes=10 * todo.remind_count)
-                            elif display_time < now:
-                                display_time = now
-                            
-                            if display_time:
-                                msg += f"\n时间：{display_time.strftime('%Y-%m-%d %H:%M')}"
-                            msg += f"\n\n💡 快速完成：回复 #todo done {todo.id}"
-                            self._send(user.wework_user_id, msg)
-                            mark_reminded(todo.id)
-                            logger.info(f"[ReminderScheduler] sent reminder for todo #{todo.id} '{todo.title}' to user {user.id}")
-                        except Exception as e:
-                            logger.warning(f"[ReminderScheduler] remind failed for todo {todo.id}: {e}")
-                time.sleep(60)
-            except Exception as e:
-                logger.warning(f"[ReminderScheduler] loop error: {e}")
-                time.sleep(60)
+        logger.info(f"[ReminderScheduler] thread started, checking reminders every {self.REMIND_INTERVAL}s")
+        # 调度线程持有一个长期会话（scoped_session 按线程区分），每次任务统一提交一次
+        self._session = get_session()
+        self._sched.enter(0, 0, self._tick_reminders)
+        self._sched.enter(0, 1, self._balance_job)
+        # 8:00-8:10 之间启动时补推当天天气（与原先的推送窗口一致），否则等到下一个 8:00
+        now = datetime.now()
+        if now.hour == 8 and now.minute < 10:
+            self._sched.enter(0, 1, self._weather_job)
+        else:
+            self._sched.enterabs(self._next_daily(8, 0), 1, self._weather_job)
+        self._sched.enterabs(self._next_daily(0, 1), 1, self._recover_job)
+        # 线程在最近一个任务的到期时间上等待，stop() 清空队列后 run() 返回
+        self._sched.run()
+        self._session.close()
+
+    def _wait(self, timeout: float):
+        """sched 的等待函数：在 stop 事件上等待，stop() 时立即唤醒并清空任务队列"""
+        if self._stop.wait(timeout):
+            # 在调度线程内取消剩余任务，sched.run() 随即返回
+            for event in self._sched.queue:
+                try:
+                    self._sched.cancel(event)
+                except ValueError:
+                    pass
+
+    def _enter(self, delay: float, action: Callable[[], None]):
+        if not self._stop.is_set():
+            self._sched.enter(delay, 0, action)
+
+    def _enterabs(self, ts: float, action: Callable[[], None]):
+        if not self._stop.is_set():
+            self._sched.enterabs(ts, 0, action)
+
+    @staticmethod
+    def _next_daily(hour: int, minute: int, min_delay: float = 0.0) -> float:
+        """下一个本地时间 hour:minute 对应的单调时钟时间点（至少在 min_delay 秒之后）"""
+        now = datetime.now()
+        target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target <= now + timedelta(seconds=min_delay):
+            target += timedelta(days=1)
+        return time.monotonic() + (target - now).total_seconds()
 
+    def _weather_job(self):
+        """每日天气推送（早上8点，每天只推送一次）"""
+        try:
+            # 先比较日期，当天已推送过则直接跳过
+            today = datetime.now().date()
+            if self._last_weather_date != today:
+                self._send_daily_weather()
+                self._last_weather_date = today
+                logger.info("[ReminderScheduler] Sent daily weather")
+        finally:
+            # 单调时钟与系统时间可能有少许偏差，避免提前触发后又排到当天
+            self._enterabs(self._next_daily(8, 0, min_delay=60), self._weather_job)
+
+    def _balance_job(self):
+        """API余额检查（每30分钟）"""
+        try:
+            self._check_api_balance()
+        finally:
+            self._enter(self.BALANCE_INTERVAL, self._balance_job)
+
+    def _recover_job(self):
+        """凌晨恢复失败任务（每天 00:01）"""
+        try:
+            count = recover_failed_todos(session=self._session)
+            self._session.commit()
+            if count > 0:
+                logger.info(f"[ReminderScheduler] recovered {count} failed todos at midnight")
+        except Exception as e:
+            self._session.rollback()
+            logger.warning(f"[ReminderScheduler] recover failed todos error: {e}")
+        finally:
+            self._enterabs(self._next_daily(0, 1, min_delay=60), self._recover_job)
 
+    def _tick_reminders(self):
+        """检查并发送到期提醒"""
+        session = self._session
+        delay = self.REMIND_INTERVAL
+        try:
+            self._check_count += 1
+            # 使用本地时间（与数据库中的 remind_at 一致）
+            now = datetime.now()
+            # 每10次检查输出一次日志，避免刷屏（时间由日志格式中的 asctime 给出，无需再 strftime）
+            # 每轮都会执行的日志使用 % 参数，级别被过滤时不做字符串格式化
+            if self._check_count % 10 == 1:
+                logger.info("[ReminderScheduler] alive, checked %d times", self._check_count)
+            
+            # 还没到最早的提醒时间且待办没有变更时，本轮不访问数据库
+            seq = todo_change_seq()
+            if (seq == self._next_due_seq
+                    and time.monotonic() < self._next_due_deadline
+                    and (self._next_due_at is None or now < self._next_due_at)):
+                return
+            
+            due = fetch_due_reminders(now, session=session)
+            if due:
+                logger.info("[ReminderScheduler] found %d due reminders", len(due))
+                futures = []
+                for todo_id, title, remind_at, remind_count, wework_user_id, user_id in due:
+                    msg = f"⏰ 提醒：{title}"
+                    
+                    display_time = remind_at or now
+                    # 对于重复提醒（remind_count>0），显示提醒时间 + 10 分钟 * 提醒次数
+                    if remind_count and remind_count > 0 and remind_at:
+                        display_time = remind_at + timedelta(minutes=10 * remind_count)
+                    elif display_time < now:
+                        display_time = now
+                    
+                    if display_time:
+                        msg += f"\n时间：{display_time.strftime('%Y-%m-%d %H:%M')}"
+                    msg += f"\n\n💡 快速完成：回复 #todo done {todo_id}"
+                    futures.append((self._pool.submit(self._send, wework_user_id, msg), todo_id, title, user_id, wework_user_id))
+                
+                # 等待全部发送结束，只标记发送成功的待办
+                sent_ids = []
+                log_sent = logger.isEnabledFor(logging.INFO)
+                for fut, todo_id, title, user_id, wework_user_id in futures:
+                    e = fut.exception()
+                    if e is None:
+                        sent_ids.append(todo_id)
+                        note_reminder_sent(wework_user_id)
+                        if log_sent:
+                            logger.info("[ReminderScheduler] sent reminder for todo #%s '%s' to user %s", todo_id, title, user_id)
+                    else:
+                        logger.warning(f"[ReminderScheduler] remind failed for todo {todo_id}: {e}")
+                # 发送完成后一次性标记已提醒
+                if sent_ids:
+                    mark_reminded_bulk(sent_ids, now, session=session)
+            self._next_due_at = fetch_next_due_at(session=session)
+            session.commit()
+            self._next_due_seq = seq
+            self._next_due_deadline = time.monotonic() + self.NEXT_DUE_MAX_SKIP
+            self._db_retries = 0
+        except OperationalError as e:
+            # 数据库连接抖动：按指数退避尽快重试，而不是等满一个检查周期
+            session.rollback()
+            self._db_retries += 1
+            delay = min(2 ** self._db_retries, self.REMIND_INTERVAL)
+            logger.warning(f"[ReminderScheduler] database error, retry in {delay}s: {e}")
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"[ReminderScheduler] remind loop error: {e}")
+        finally:
+            self._enter(delay, self._tick_reminders)
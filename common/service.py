@@ -2,19 +2,130 @@
 
 import re
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
+from typing import Callable, Dict, Optional, Tuple, List
 
-from sqlalchemy import select, update, delete, func
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select, update, delete, insert, func, case, or_, and_, event
+from sqlalchemy.orm import Session
 
+from common import json_utils
 from common.db import get_session
 from common.models import User, Expense, Todo
 from common.log import logger
 from config import conf
 
 
+# 常用正则在模块加载时预编译
+_NUM_RE = re.compile(r"(-?\d+(?:\.\d+)?)")
+_NOREMIND_RE = re.compile(r"/(noremind|不提醒|无提醒|no)", re.IGNORECASE)
+_AT_RE = re.compile(r"/at\s+([0-9]{4}[-/][0-9]{2}[-/][0-9]{2})\s+([0-9]{2}:[0-9]{2})")
+# LLM 有时会用 markdown 代码块包裹 JSON
+_MD_FENCE_RE = re.compile(r"```(?:json)?\s*")
+# 常见中文时间表达：[日期][时段][时:分 / 时点[半|分]]，如“明天下午3点”“周五晚上8点半”“今晚20:30”，各部分之间允许空格
+_RULE_TIME_RE = re.compile(
+    r"(?P<day>大后天|后天|明天|明日|明早|今天|今日|今晚|下(?:周|星期|礼拜)[一二三四五六日天]|(?:周|星期|礼拜)[一二三四五六日天])?"
+    r"\s*(?P<period>早上|上午|中午|下午|晚上|凌晨)?"
+    r"\s*(?:(?P<hour>\d{1,2})(?:[:：](?P<minute>\d{2})|点(?:(?P<half>半)|(?P<minute2>\d{1,2})分?)?))?"
+)
+# 只有时段词（如“下午”）时，其后须是短语结尾，避免把“下午茶”“早上好”当成时间
+_PHRASE_END = " \t，,。.!！?？;；"
+_DAY_OFFSETS = {"今天": 0, "今日": 0, "今晚": 0, "明天": 1, "明日": 1, "明早": 1, "后天": 2, "大后天": 3}
+# 日期词本身隐含的时段
+_DAY_PERIODS = {"今晚": "晚上", "明早": "早上"}
+_WEEKDAY_NUM = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+# 只说时段未说具体时间时的默认小时
+_PERIOD_HOURS = {"早上": 9, "上午": 9, "中午": 12, "下午": 15, "晚上": 19, "凌晨": 1}
+# 时段对 12 小时制钟点的修正：下午/晚上 3 点 -> 15 点，中午 1 点 -> 13 点
+_PERIOD_PM = {"下午", "晚上", "中午"}
+
+
+# 待办提醒相关的变更序号：新建/修改提醒时间等操作后递增，调度器据此判断缓存的下次到期时间是否失效
+_todo_change_seq = 0
+
+
+def _mark_todos_changed():
+    global _todo_change_seq
+    _todo_change_seq += 1
+
+
+def todo_change_seq() -> int:
+    return _todo_change_seq
+
+
+# 各用户最近一次收到提醒的时间（单调时钟），快捷完成指令据此判断是否需要查询数据库
+_last_reminder_sent: Dict[str, float] = {}
+
+
+def note_reminder_sent(wework_user_id: str):
+    """记录已向该用户发送提醒（由提醒调度器在发送成功后调用）"""
+    _last_reminder_sent[wework_user_id] = time.monotonic()
+
+
+def reminded_recently(wework_user_id: str, within: float = 300) -> bool:
+    """该用户在最近 within 秒内是否收到过提醒"""
+    ts = _last_reminder_sent.get(wework_user_id)
+    return ts is not None and time.monotonic() - ts <= within
+
+
+@contextmanager
+def _session_scope(session=None):
+    """复用调用方传入的会话（由调用方负责提交/回滚），否则新开会话并在成功后提交"""
+    if session is not None:
+        yield session
+        return
+    with get_session() as s:
+        yield s
+        s.commit()
+
+
+# 会话提交成功后才执行的回调（通知调度器、启动后台解析等），暂存在 session.info 中
+_AFTER_COMMIT_KEY = "after_commit_callbacks"
+
+
+def _on_commit(session, fn: Callable[[], None]):
+    """会话提交成功后执行 fn；回滚或未提交就关闭时丢弃
+    scoped session 在关闭后会被同一线程复用，回调不能留到下一次无关的提交
+    """
+    session.info.setdefault(_AFTER_COMMIT_KEY, []).append(fn)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    for fn in session.info.pop(_AFTER_COMMIT_KEY, ()):
+        try:
+            fn()
+        except Exception as e:
+            logger.exception("[DB] After-commit callback failed: %s", e)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_after_commit(session, transaction):
+    # 提交时 after_commit 先于此事件触发；走到这里还留着的回调属于回滚或未提交的事务
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT_KEY, None)
+
+
+_TITLE_MAX_LEN = 128
+
+
+def _clip(s: str, n: int = _TITLE_MAX_LEN) -> str:
+    """截断到 n 个字符，未超长时直接返回原字符串，不产生拷贝"""
+    return s if len(s) <= n else s[:n]
+
+
+def _normalize_title(raw: Optional[str]) -> str:
+    """待办标题统一处理：去掉首尾空白并截断到字段长度"""
+    return _clip((raw or "").strip())
+
+
 def _first_number(text: str) -> Optional[float]:
-    m = re.search(r"(-?\d+(?:\.\d+)?)", text)
+    m = _NUM_RE.search(text)
     if not m:
         return None
     try:
@@ -27,133 +138,224 @@ def _parse_time_with_llm(text: str) -> Tuple[str, Optional[datetime]]:
     """使用 LLM API 解析文本中的时间和任务
     返回: (任务名称, 提醒时间)
     """
+    if not conf().get("open_ai_api_key"):
+        logger.warning("[Todo] LLM API key not configured, skip LLM parsing")
+        return text, None
+    
+    now = datetime.now()
     try:
-        import openai
-        
-        api_key = conf().get("open_ai_api_key")
-        api_base = conf().get("open_ai_api_base")
-        model = conf().get("model") or "gpt-3.5-turbo"
-        
-        if not api_key:
-            logger.warning("[Todo] LLM API key not configured, skip LLM parsing")
-            return text, None
-        
-        logger.info(f"[Todo] Starting LLM parsing for: {text}")
-        
-        openai.api_key = api_key
-        if api_base:
-            openai.api_base = api_base
-        
-        now = datetime.now()
-        current_date = now.strftime("%Y-%m-%d")
-        current_time = now.strftime("%H:%M")
-        current_weekday = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"][now.weekday()]
-        
-        # 计算未来几天的日期
-        tomorrow = now + timedelta(days=1)
-        day_after_tomorrow = now + timedelta(days=2)
-        
-        # 计算本周剩余的日期
-        weekday_names = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
-        current_weekday_num = now.weekday()  # 0=周一, 6=周日
-        
-        system_prompt = (
-            "你是一个智能时间解析助手。用户会输入包含任务和时间的文本，你需要准确提取任务名称和提醒时间。\n\n"
-            "## 当前时间信息\n"
-            f"- 完整时间：{current_date} {current_time} ({current_weekday})\n"
-            f"- 明天：{tomorrow.strftime('%Y-%m-%d')} ({weekday_names[tomorrow.weekday()]})\n"
-            f"- 后天：{day_after_tomorrow.strftime('%Y-%m-%d')} ({weekday_names[day_after_tomorrow.weekday()]})\n\n"
-            "## 时间解析规则\n"
-            "1. **相对时间**：\n"
-            "   - '今天/今日/今晚' → 今天的日期\n"
-            "   - '明天/明日/明早' → 明天的日期\n"
-            "   - '后天' → 后天的日期\n"
-            "   - '大后天' → 3天后\n\n"
-            "2. **星期表达**：\n"
-            "   - '周一/星期一/礼拜一' → 本周或下周的周一（如果今天是周一之后，则是下周）\n"
-            "   - '周五/星期五' → 本周或下周的周五\n"
-            "   - '下周一/下周五' → 明确指下周\n\n"
-            "3. **时间点**：\n"
-            "   - '早上/上午' → 09:00（如未指定具体时间）\n"
-            "   - '中午' → 12:00\n"
-            "   - '下午' → 15:00（如未指定具体时间）\n"
-            "   - '晚上' → 19:00（如未指定具体时间）\n"
-            "   - '凌晨' → 01:00（如未指定具体时间）\n"
-            "   - '3点/3点半/15:30' → 具体时间\n\n"
-            "4. **组合表达**：\n"
-            "   - '明天下午3点' → 明天 15:00\n"
-            "   - '周五晚上8点' → 本周或下周五 20:00\n"
-            "   - '今晚8点' → 今天 20:00\n\n"
-            "5. **智能判断**：\n"
-            "   - 如果时间已过，自动推到明天或下一个合适的时间\n"
-            "   - 如果只说'3点'且当前已过3点，推到明天3点\n\n"
-            "## 输出格式\n"
-            "必须返回有效的JSON，包含：\n"
-            "- title: 任务名称（去掉时间描述，保留核心任务）\n"
-            "- remind_at: 提醒时间（格式：YYYY-MM-DD HH:MM，无法解析则为null）\n\n"
-            "## 示例\n"
-            f"输入：'明天下午3点开会'\n"
-            f"输出：{{\"title\": \"开会\", \"remind_at\": \"{tomorrow.strftime('%Y-%m-%d')} 15:00\"}}\n\n"
-            f"输入：'今晚8点提醒我'\n"
-            f"输出：{{\"title\": \"提醒我\", \"remind_at\": \"{current_date} 20:00\"}}\n\n"
-            f"输入：'周五下午提交报告'\n"
-            f"输出：{{\"title\": \"提交报告\", \"remind_at\": \"[计算本周或下周五的日期] 15:00\"}}\n\n"
-            "输入：'买牛奶'\n"
-            "输出：{\"title\": \"买牛奶\", \"remind_at\": null}\n\n"
-            "注意：只返回JSON，不要有其他文字！"
-        )
-        
-        user_prompt = f"请解析以下文本，提取任务名称和提醒时间：\n{text}"
-        
-        resp = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
+        # 同一分钟内相同的文本直接复用解析结果
+        title, remind_at_str = _llm_parse_cached(text, now.strftime("%Y-%m-%d %H:%M"))
+    except json.JSONDecodeError:
+        return text, None
+    except Exception as e:
+        logger.exception("[Todo] LLM parsing failed: %s", e)
+        return text, None
+    
+    if remind_at_str:
+        try:
+            remind_at = datetime.strptime(remind_at_str, "%Y-%m-%d %H:%M")
+            # 如果解析出的时间已过期，自动调整为明天同一时间
+            if remind_at <= now - timedelta(minutes=5):
+                logger.info("[Todo] Parsed time %s is in the past, adjusting to tomorrow", remind_at)
+                remind_at = remind_at + timedelta(days=1)
+            logger.info("[Todo] Final result - title: '%s', remind_at: %s", title, remind_at)
+            return title, remind_at
+        except ValueError as e:
+            logger.warning("[Todo] Failed to parse time '%s': %s", remind_at_str, e)
+            return title, None
+    else:
+        logger.info("[Todo] No remind_at in LLM response, returning title only")
+        return title, None
+
+
+# LLM 时间解析的系统提示词：只包含固定的规则和示例，不含任何随日期变化的内容，
+# 使每次请求的前缀完全一致（OpenAI 等服务对相同前缀自动做提示词缓存）
+_TIME_PARSE_SYSTEM_PROMPT = (
+    "你是一个智能时间解析助手。用户会输入包含任务和时间的文本，你需要准确提取任务名称和提醒时间。\n"
+    "用户消息开头的「当前时间信息」给出了今天、明天、后天的日期，请以此为准计算日期。\n\n"
+    "## 时间解析规则\n"
+    "1. **相对时间**：\n"
+    "   - '今天/今日/今晚' → 今天的日期\n"
+    "   - '明天/明日/明早' → 明天的日期\n"
+    "   - '后天' → 后天的日期\n"
+    "   - '大后天' → 3天后\n\n"
+    "2. **星期表达**：\n"
+    "   - '周一/星期一/礼拜一' → 本周或下周的周一（如果今天是周一之后，则是下周）\n"
+    "   - '周五/星期五' → 本周或下周的周五\n"
+    "   - '下周一/下周五' → 明确指下周\n\n"
+    "3. **时间点**：\n"
+    "   - '早上/上午' → 09:00（如未指定具体时间）\n"
+    "   - '中午' → 12:00\n"
+    "   - '下午' → 15:00（如未指定具体时间）\n"
+    "   - '晚上' → 19:00（如未指定具体时间）\n"
+    "   - '凌晨' → 01:00（如未指定具体时间）\n"
+    "   - '3点/3点半/15:30' → 具体时间\n\n"
+    "4. **组合表达**：\n"
+    "   - '明天下午3点' → 明天 15:00\n"
+    "   - '周五晚上8点' → 本周或下周五 20:00\n"
+    "   - '今晚8点' → 今天 20:00\n\n"
+    "5. **智能判断**：\n"
+    "   - 如果时间已过，自动推到明天或下一个合适的时间\n"
+    "   - 如果只说'3点'且当前已过3点，推到明天3点\n\n"
+    "## 输出格式\n"
+    "必须返回有效的JSON，包含：\n"
+    "- title: 任务名称（去掉时间描述，保留核心任务）\n"
+    "- remind_at: 提醒时间（格式：YYYY-MM-DD HH:MM，无法解析则为null）\n\n"
+    "## 示例（日期以当前时间信息为准）\n"
+    "输入：'明天下午3点开会'\n"
+    "输出：{\"title\": \"开会\", \"remind_at\": \"[明天的日期] 15:00\"}\n\n"
+    "输入：'今晚8点提醒我'\n"
+    "输出：{\"title\": \"提醒我\", \"remind_at\": \"[今天的日期] 20:00\"}\n\n"
+    "输入：'周五下午提交报告'\n"
+    "输出：{\"title\": \"提交报告\", \"remind_at\": \"[计算本周或下周五的日期] 15:00\"}\n\n"
+    "输入：'买牛奶'\n"
+    "输出：{\"title\": \"买牛奶\", \"remind_at\": null}\n\n"
+    "注意：只返回JSON，不要有其他文字！"
+)
+_WEEKDAY_NAMES = ("周一", "周二", "周三", "周四", "周五", "周六", "周日")
+
+
+# LLM 解析请求的 (连接超时, 读取超时)
+_LLM_TIMEOUT = (3, 15)
+
+
+@lru_cache(maxsize=None)
+def _llm_http() -> requests.Session:
+    """LLM 解析共用的 HTTP 会话，保持 keep-alive，避免每次解析都重新建立 TLS 连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@lru_cache(maxsize=512)
+def _llm_parse_cached(text: str, now_minute: str) -> Tuple[str, Optional[str]]:
+    """调用 LLM 解析，按 (文本, 当前分钟) 缓存，只返回不可变的基本类型
+    now_minute 格式：YYYY-MM-DD HH:MM；解析失败时抛出异常，失败结果不会被缓存
+    返回: (任务名称, 提醒时间字符串)
+    """
+    api_key = conf().get("open_ai_api_key")
+    api_base = (conf().get("open_ai_api_base") or "https://api.openai.com/v1").rstrip("/")
+    model = conf().get("todo_parse_model") or conf().get("model") or "gpt-3.5-turbo"
+    
+    logger.debug("[Todo] Starting LLM parsing for: %s", text)
+    
+    now = datetime.strptime(now_minute, "%Y-%m-%d %H:%M")
+    tomorrow = now + timedelta(days=1)
+    day_after_tomorrow = now + timedelta(days=2)
+    
+    # 当天的日期信息放在用户消息里，系统提示词保持不变，便于服务端命中前缀缓存
+    context_msg = (
+        "## 当前时间信息\n"
+        f"- 完整时间：{now_minute} ({_WEEKDAY_NAMES[now.weekday()]})\n"
+        f"- 明天：{tomorrow.strftime('%Y-%m-%d')} ({_WEEKDAY_NAMES[tomorrow.weekday()]})\n"
+        f"- 后天：{day_after_tomorrow.strftime('%Y-%m-%d')} ({_WEEKDAY_NAMES[day_after_tomorrow.weekday()]})\n\n"
+    )
+    user_prompt = f"{context_msg}请解析以下文本，提取任务名称和提醒时间：\n{text}"
+    
+    resp = _llm_http().post(
+        f"{api_base}/chat/completions",
+        headers={"Authorization": f"Bearer {api_key}"},
+        json={
+            "model": model,
+            "messages": [
+                {"role": "system", "content": _TIME_PARSE_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
-            temperature=0.1,
-            max_tokens=200,
-        )
-        
-        content = resp["choices"][0]["message"]["content"].strip()
-        logger.info(f"[Todo] LLM parsing result: {content}")
-        
-        # 尝试解析 JSON
-        # 有时候 LLM 会在 JSON 外包裹 markdown 代码块，需要去掉
-        content = re.sub(r'```json\s*', '', content)
-        content = re.sub(r'```\s*', '', content)
-        content = content.strip()
-        
+            "temperature": 0.1,
+            # 输出只有标题和时间两个字段
+            "max_tokens": 80,
+            "response_format": {"type": "json_object"},
+        },
+        timeout=_LLM_TIMEOUT,
+    )
+    resp.raise_for_status()
+    
+    content = json_utils.loads(resp.content)["choices"][0]["message"]["content"].strip()
+    logger.debug("[Todo] LLM parsing result: %s", content)
+    
+    # 尝试解析 JSON
+    # 兼容不支持 response_format 的接口：LLM 有时会在 JSON 外包裹 markdown 代码块，需要去掉
+    content = _MD_FENCE_RE.sub('', content).strip()
+    
+    try:
         result = json.loads(content)
-        title = result.get("title", text).strip()
-        remind_at_str = result.get("remind_at")
-        
-        logger.info(f"[Todo] Extracted - title: '{title}', remind_at: '{remind_at_str}'")
-        
-        if remind_at_str:
-            try:
-                remind_at = datetime.strptime(remind_at_str, "%Y-%m-%d %H:%M")
-                # 如果解析出的时间已过期，自动调整为明天同一时间
-                if remind_at <= now - timedelta(minutes=5):
-                    logger.info(f"[Todo] Parsed time {remind_at} is in the past, adjusting to tomorrow")
-                    remind_at = remind_at + timedelta(days=1)
-                logger.info(f"[Todo] Final result - title: '{title}', remind_at: {remind_at}")
-                return title, remind_at
-            except ValueError as e:
-                logger.warning(f"[Todo] Failed to parse time '{remind_at_str}': {e}")
-                return title, None
-        else:
-            logger.info(f"[Todo] No remind_at in LLM response, returning title only")
-            return title, None
-            
     except json.JSONDecodeError as e:
-        logger.error(f"[Todo] Failed to parse LLM response as JSON: {e}, content: {content}")
-        return text, None
-    except Exception as e:
-        logger.error(f"[Todo] LLM parsing failed: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return text, None
+        logger.error("[Todo] Failed to parse LLM response as JSON: %s, content: %s", e, content)
+        raise
+    title = result.get("title", text).strip()
+    remind_at_str = result.get("remind_at")
+    
+    logger.debug("[Todo] Extracted - title: '%s', remind_at: '%s'", title, remind_at_str)
+    return title, remind_at_str
+
+
+def _rule_parse_time(text: str, now: Optional[datetime] = None) -> Optional[Tuple[str, datetime]]:
+    """规则解析常见的中文时间表达（与 LLM 提示词中的规则一致），无法确定时返回 None 交给 LLM
+    返回: (任务名称, 提醒时间)
+    """
+    m = None
+    for cur in _RULE_TIME_RE.finditer(text):
+        if not cur.group(0).strip():
+            continue
+        # 日期和时间分散在不同位置（如“明天开会 15:30”）或出现多个时间时无法确定，交给 LLM
+        if m is not None or not (cur.group("period") or cur.group("hour") or cur.group("day") in _DAY_PERIODS):
+            return None
+        m = cur
+    if m is None:
+        return None
+    
+    day, period, hour = m.group("day"), m.group("period"), m.group("hour")
+    if hour is None:
+        # 只有时段：须带日期或位于短语结尾
+        end = m.end("period") if period else m.end()
+        if not day and end < len(text) and text[end] not in _PHRASE_END:
+            return None
+    elif m.group("minute") is None and not day and not period:
+        # 单独的“N点”常见于“第3点意见”这类非时间用法
+        return None
+    period = period or _DAY_PERIODS.get(day)
+    
+    now = now or datetime.now()
+    extra = timedelta(0)
+    if hour is None:
+        hour, minute = _PERIOD_HOURS[period], 0
+    else:
+        hour = int(hour)
+        minute = 30 if m.group("half") else int(m.group("minute") or m.group("minute2") or 0)
+        if hour == 12 and period in ("晚上", "凌晨"):
+            # 晚上12点即次日 0 点
+            hour = 0
+            if period == "晚上":
+                extra = timedelta(days=1)
+        elif period in _PERIOD_PM and hour < 12:
+            hour += 12
+    if hour > 23 or minute > 59:
+        return None
+    
+    title = (text[: m.start()] + text[m.end():]).strip(" ，,。")
+    if not title:
+        return None
+    
+    base = now.replace(hour=hour, minute=minute, second=0, microsecond=0) + extra
+    if day and day not in _DAY_OFFSETS:
+        # 周X：本周或下周的周X；下周X：明确指下周
+        target = _WEEKDAY_NUM[day[-1]]
+        if day.startswith("下"):
+            days = 7 - now.weekday() + target
+        else:
+            days = (target - now.weekday()) % 7
+            if days == 0 and base <= now - timedelta(minutes=5):
+                days = 7
+        remind_at = base + timedelta(days=days)
+    else:
+        remind_at = base + timedelta(days=_DAY_OFFSETS.get(day, 0))
+        # 时间已过则推到明天（与 LLM 结果的处理一致）
+        if remind_at <= now - timedelta(minutes=5):
+            remind_at += timedelta(days=1)
+    return title, remind_at
 
 
 def _parse_at(text: str) -> Tuple[str, Optional[datetime]]:
@@ -161,46 +363,90 @@ def _parse_at(text: str) -> Tuple[str, Optional[datetime]]:
     优先级：
     1. /noremind 或 /不提醒（明确不设置提醒）
     2. /at 格式（精确格式）
-    3. LLM 智能解析（自然语言）
+    3. 规则解析常见中文时间表达
+    4. LLM 智能解析（自然语言）
+    """
+    parsed = _parse_at_fast(text)
+    if parsed is not None:
+        return parsed
+    
+    # 4. 使用 LLM 进行智能解析（支持自然语言）
+    # 例如："明天下午3点开会"、"周五提交报告"、"今晚8点提醒我"
+    logger.info("[Todo] Using LLM to parse natural language time: %s", text)
+    return _parse_time_with_llm(text)
+
+
+def _parse_at_fast(text: str) -> Optional[Tuple[str, Optional[datetime]]]:
+    """不调用 LLM 的解析（_parse_at 的 1-3 步），无法确定时返回 None"""
+    parsed = _parse_directives(text)
+    if parsed is not None:
+        return parsed
+    
+    # 3. 规则能确定的常见表达直接解析，省去一次 LLM 调用
+    # 相对时间（明天、周五）依赖当前时间，不能缓存
+    parsed = _rule_parse_time(text)
+    if parsed:
+        logger.info("[Todo] Parsed by rules - title: '%s', time: %s", parsed[0], parsed[1])
+        return parsed
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _parse_directives(text: str) -> Optional[Tuple[str, Optional[datetime]]]:
+    """解析 /noremind 与 /at 指令（_parse_at 的 1-2 步），没有指令时返回 None
+    结果只取决于文本本身（/at 是绝对时间），重复发送的相同内容直接命中缓存
     """
     # 1. 检查是否明确指定不提醒
-    noremind_pattern = r"/(noremind|不提醒|无提醒|no)"
-    m_noremind = re.search(noremind_pattern, text, re.IGNORECASE)
+    m_noremind = _NOREMIND_RE.search(text)
     if m_noremind:
         # 去掉指令片段
         new_text = (text[: m_noremind.start()] + text[m_noremind.end():]).strip()
-        logger.info(f"[Todo] No remind specified - title: '{new_text}'")
+        logger.info("[Todo] No remind specified - title: '%s'", new_text)
         return new_text, None
     
     # 2. 检查 /at 格式：/at YYYY-MM-DD HH:MM
-    m = re.search(r"/at\s+([0-9]{4}[-/][0-9]{2}[-/][0-9]{2})\s+([0-9]{2}:[0-9]{2})", text)
+    m = _AT_RE.search(text)
     if m:
         date_part = m.group(1).replace("/", "-")
         time_part = m.group(2)
         dt = datetime.strptime(f"{date_part} {time_part}", "%Y-%m-%d %H:%M")
         # 去掉指令片段
         new_text = (text[: m.start()] + text[m.end():]).strip()
-        logger.info(f"[Todo] Parsed /at format - title: '{new_text}', time: {dt}")
+        logger.info("[Todo] Parsed /at format - title: '%s', time: %s", new_text, dt)
         return new_text, dt
-    
-    # 3. 使用 LLM 进行智能解析（支持自然语言）
-    # 例如："明天下午3点开会"、"周五提交报告"、"今晚8点提醒我"
-    logger.info(f"[Todo] Using LLM to parse natural language time: {text}")
-    return _parse_time_with_llm(text)
+    return None
 
 
-def ensure_user(wework_conversation_id: str, nickname: Optional[str]) -> User:
-    with get_session() as s:
-        u = s.execute(select(User).where(User.wework_user_id == wework_conversation_id)).scalar_one_or_none()
-        if u:
-            if nickname and u.nickname != nickname:
-                u.nickname = nickname
-                s.commit()
-            return u
-        u = User(wework_user_id=wework_conversation_id, nickname=nickname)
-        s.add(u)
-        s.commit()
-        s.refresh(u)
+# 会话 id -> 用户主键缓存（只缓存 int，不持有任何 Session 中的对象）
+# 活跃用户集中在少数几个会话，命中后只需按主键获取
+_USER_ID_CACHE_MAX = 4096
+_user_ids: Dict[str, int] = {}
+
+
+def ensure_user(wework_conversation_id: str, nickname: Optional[str], session=None) -> User:
+    """获取或创建用户
+    传入 session 时在调用方的事务中执行（由调用方提交），一条消息的处理只需一次提交
+    """
+    with _session_scope(session) as s:
+        user_id = _user_ids.get(wework_conversation_id)
+        u = s.get(User, user_id) if user_id is not None else None
+        if u is not None and u.wework_user_id != wework_conversation_id:
+            # 缓存的用户已被删除（主键可能被复用），按会话 id 重新查询
+            u = None
+        if u is None:
+            u = s.execute(
+                select(User).where(User.wework_user_id == wework_conversation_id)
+            ).scalar_one_or_none()
+        if u is None:
+            u = User(wework_user_id=wework_conversation_id, nickname=nickname)
+            s.add(u)
+            # flush 后即可拿到自增主键，无需提交后再 refresh
+            s.flush()
+        elif nickname and u.nickname != nickname:
+            u.nickname = nickname
+        if len(_user_ids) >= _USER_ID_CACHE_MAX:
+            _user_ids.clear()
+        _user_ids[wework_conversation_id] = u.id
         return u
 
 
@@ -208,20 +454,21 @@ def create_expense_for_text(
     user: User,
     text: str,
     source_msg_id: Optional[str] = None,
+    session=None,
 ) -> Tuple[bool, str]:
     amount = _first_number(text)
     if amount is None:
         return False, "未识别到金额，请使用示例：#记账 18.5 咖啡 备注"
     # 去掉金额，尝试解析分类和备注
-    text_wo_amount = re.sub(r"(-?\d+(?:\.\d+)?)", "", text, count=1).strip()
+    text_wo_amount = _NUM_RE.sub("", text, count=1).strip()
     parts = text_wo_amount.split()
     category = parts[0] if parts else None
     note = " ".join(parts[1:]) if len(parts) > 1 else None
 
-    with get_session() as s:
+    with _session_scope(session) as s:
         exp = Expense(
             user_id=user.id,
-            amount=amount,
+            amount=round(amount * 100),
             currency="CNY",
             category=category,
             note=note,
@@ -229,136 +476,234 @@ def create_expense_for_text(
             source_msg_id=source_msg_id,
         )
         s.add(exp)
-        s.commit()
         return True, f"已记账：¥{amount:.2f} {category or ''} {note or ''}"
 
 
+def bulk_insert_expenses(user: User, rows: List[dict]) -> int:
+    """批量记账（如一张小票 OCR 出多条记录），一次 executemany 写入
+    rows: [{"amount": 18.5, "category": "咖啡", "merchant": ..., "note": ..., "spent_at": ...}, ...]
+    amount 单位为元；未提供 spent_at 时使用当前时间
+    返回写入的条数
+    """
+    if not rows:
+        return 0
+    now = datetime.now()
+    values = [
+        {
+            "user_id": user.id,
+            "amount": round(float(row["amount"]) * 100),
+            "currency": row.get("currency") or "CNY",
+            "category": row.get("category"),
+            "merchant": row.get("merchant"),
+            "note": row.get("note"),
+            "spent_at": row.get("spent_at") or now,
+            "source_msg_id": row.get("source_msg_id"),
+            "image_url": row.get("image_url"),
+            "ocr_text": row.get("ocr_text"),
+            "created_at": now,
+        }
+        for row in rows
+    ]
+    with get_session() as s:
+        s.execute(insert(Expense), values)
+        s.commit()
+    return len(values)
+
+
+# 后台解析自然语言时间的线程池，入站消息无需等待 LLM 返回
+_LLM_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="todo-llm-parse")
+
+
 def create_todo_for_text(
     user: User,
     text: str,
+    session=None,
+    notify: Optional[Callable[[str], None]] = None,
 ) -> Tuple[bool, str]:
-    body, remind_at = _parse_at(text)
-    title = body.strip()
+    """根据用户输入创建待办
+    规则能解析的直接写入；需要 LLM 解析时先用原文创建待办并立即返回，
+    提醒时间在后台解析完成后写回，解析出时间后通过 notify(text) 告知用户
+    """
+    parsed = _parse_at_fast(text)
+    if parsed is None and not conf().get("open_ai_api_key"):
+        parsed = text, None
+    if parsed is not None:
+        body, remind_at = parsed
+        title = _normalize_title(body)
+        if not title:
+            return False, "待办内容不能为空。示例：#todo 明早9点开会 /at 2025-10-22 09:00"
+        return create_todo(user, title, remind_at, session=session)
+    
+    title = _normalize_title(text)
     if not title:
         return False, "待办内容不能为空。示例：#todo 明早9点开会 /at 2025-10-22 09:00"
-    with get_session() as s:
-        todo = Todo(
-            user_id=user.id,
-            title=title[:128],
-            remind_at=remind_at,
-            status="pending",
-        )
+    with _session_scope(session) as s:
+        todo = Todo(user_id=user.id, title=title, remind_at=None, status="pending")
         s.add(todo)
-        s.commit()
-        when = remind_at.strftime("%Y-%m-%d %H:%M") if remind_at else "未设置提醒"
-        return True, f"已创建待办：{title}（提醒：{when}）"
+        s.flush()
+        # 提交后再开始解析，保证后台线程能看到这条待办；事务回滚时不会解析
+        _on_commit(s, partial(_LLM_EXECUTOR.submit, _finalize_parse, todo.id, text, notify))
+        _on_commit(s, _mark_todos_changed)
+    return True, f"已创建待办：{title}（正在识别提醒时间…）"
+
 
+def _finalize_parse(todo_id: int, text: str, notify: Optional[Callable[[str], None]] = None):
+    """后台线程：LLM 解析出时间后用一条 UPDATE 写回标题和提醒时间"""
+    try:
+        title, remind_at = _parse_time_with_llm(text)
+        if remind_at is None:
+            # 没有识别出时间，保留原文作为标题
+            return
+        values = {"remind_at": remind_at, "reminded": False}
+        title = _normalize_title(title)
+        if title:
+            values["title"] = title
+        with get_session() as s:
+            # 用户在此期间已手动设置时间或完成了待办时不覆盖
+            result = s.execute(
+                update(Todo)
+                .where(Todo.id == todo_id, Todo.status == "pending", Todo.remind_at == None)  # noqa: E711
+                .values(**values)
+            )
+            s.commit()
+        if not result.rowcount:
+            return
+        _mark_todos_changed()
+        if notify:
+            notify(f"已设置提醒：{title or text}（提醒：{remind_at.strftime('%Y-%m-%d %H:%M')}）")
+    except Exception as e:
+        logger.exception("[Todo] Background time parsing failed for todo %s: %s", todo_id, e)
 
-def create_todo(user: User, title: str, remind_at: Optional[datetime]) -> Tuple[bool, str]:
-    title = (title or "").strip()
+
+def add_todo(user: User, title: str, remind_at: Optional[datetime], repeat_rule: Optional[str] = None,
+             session=None) -> Optional[Todo]:
+    """创建待办并返回新建的对象（标题为空时返回 None），传入 session 时由调用方提交"""
+    title = _normalize_title(title)
     if not title:
-        return False, "待办内容不能为空。"
-    with get_session() as s:
+        return None
+    with _session_scope(session) as s:
         todo = Todo(
             user_id=user.id,
-            title=title[:128],
+            title=title,
             remind_at=remind_at,
+            repeat_rule=repeat_rule,
             status="pending",
         )
         s.add(todo)
-        s.commit()
-        when = remind_at.strftime("%Y-%m-%d %H:%M") if remind_at else "未设置提醒"
-        return True, f"已创建待办：{title}（提醒：{when}）"
+        s.flush()
+        _on_commit(s, _mark_todos_changed)
+    return todo
+
+
+def create_todo(user: User, title: str, remind_at: Optional[datetime], session=None) -> Tuple[bool, str]:
+    """创建待办，传入 session 时由调用方提交"""
+    todo = add_todo(user, title, remind_at, session=session)
+    if todo is None:
+        return False, "待办内容不能为空。"
+    when = remind_at.strftime("%Y-%m-%d %H:%M") if remind_at else "未设置提醒"
+    return True, f"已创建待办：{todo.title}（提醒：{when}）"
 
 
-def fetch_due_reminders(now_utc: datetime):
+def fetch_due_reminders(now_utc: datetime, session=None):
     """获取需要提醒的待办事项
     包括：
     1. 首次提醒：remind_at 已到且还没提醒过
     2. 重复提醒：上次提醒后10分钟且提醒次数 < 3
+    
+    返回 (todo_id, title, remind_at, remind_count, wework_user_id, user_id) 元组列表，
+    只查询需要的列，不构造 ORM 对象
     """
-    with get_session() as s:
-        # 首次提醒或第一次重复提醒（reminded=False且刚过提醒时间）
-        initial_reminds = (
-            s.execute(
-                select(Todo, User)
-                .join(User, Todo.user_id == User.id)
-                .where(
+    columns = (Todo.id, Todo.title, Todo.remind_at, Todo.remind_count, User.wework_user_id, User.id)
+    ten_minutes_ago = now_utc - timedelta(minutes=10)
+    with _session_scope(session) as s:
+        # 两类提醒合并为一条查询，同时满足两个条件的待办只返回一次
+        return s.execute(
+            select(*columns)
+            .join(User, Todo.user_id == User.id)
+            .where(
+                Todo.status == "pending",
+                or_(
+                    # 首次提醒或第一次重复提醒（reminded=False且刚过提醒时间）
+                    and_(
+                        Todo.reminded == False,  # noqa: E712
+                        Todo.remind_at != None,  # noqa: E711
+                        Todo.remind_at <= now_utc,
+                    ),
+                    # 重复提醒：上次提醒后10分钟，且提醒次数 < 3
+                    and_(
+                        Todo.remind_count < 3,
+                        Todo.last_remind_at != None,  # noqa: E711
+                        Todo.last_remind_at <= ten_minutes_ago,
+                    ),
+                ),
+            )
+            .limit(50)
+        ).all()
+
+
+def fetch_next_due_at(session=None) -> Optional[datetime]:
+    """最早的下一次提醒到期时间，与 fetch_due_reminders 的两类条件对应：
+    首次提醒取 remind_at，重复提醒取 last_remind_at + 10 分钟；没有待提醒的待办时返回 None
+    """
+    with _session_scope(session) as s:
+        next_remind_at, last_remind_at = s.execute(
+            select(
+                select(func.min(Todo.remind_at)).where(
                     Todo.status == "pending",
                     Todo.reminded == False,  # noqa: E712
                     Todo.remind_at != None,  # noqa: E711
-                    Todo.remind_at <= now_utc,
-                )
-                .limit(50)
-            ).all()
-        )
-        
-        # 重复提醒：上次提醒后10分钟，且提醒次数 < 3
-        ten_minutes_ago = now_utc - timedelta(minutes=10)
-        repeat_reminds = (
-            s.execute(
-                select(Todo, User)
-                .join(User, Todo.user_id == User.id)
-                .where(
+                ).scalar_subquery(),
+                select(func.min(Todo.last_remind_at)).where(
                     Todo.status == "pending",
                     Todo.remind_count < 3,
-                    Todo.last_remind_at != None,
-                    Todo.last_remind_at <= ten_minutes_ago,
-                )
-                .limit(50)
-            ).all()
-        )
-        
-        # 合并结果
-        result = list(initial_reminds)
-        result.extend(repeat_reminds)
-        
-        return result
+                    Todo.last_remind_at != None,  # noqa: E711
+                ).scalar_subquery(),
+            )
+        ).one()
+    candidates = [t for t in (next_remind_at, last_remind_at and last_remind_at + timedelta(minutes=10)) if t]
+    return min(candidates) if candidates else None
+
+
+# 平年各月天数（闰年二月在计算时 +1）
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _next_remind_daily(dt: datetime) -> datetime:
+    # 每天：加1天
+    return dt + timedelta(days=1)
+
+
+def _next_remind_workday(dt: datetime) -> datetime:
+    # 工作日（周一至周五）：周一到周四加1天；周五跳到下周一（加3天）
+    return dt + timedelta(days=1 if dt.weekday() < 4 else 3)
+
+
+def _next_remind_weekly(dt: datetime) -> datetime:
+    # 每周：加7天
+    return dt + timedelta(days=7)
+
+
+def _next_remind_monthly(dt: datetime) -> datetime:
+    # 每月：加1个月，月末日期取目标月的最后一天（如1月31日 -> 2月28日）
+    year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+    max_day = _DAYS_IN_MONTH[month - 1] + (1 if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 0)
+    return dt.replace(year=year, month=month, day=min(dt.day, max_day))
+
+
+_NEXT_REMIND_FUNCS = {
+    "daily": _next_remind_daily,
+    "workday": _next_remind_workday,
+    "weekly": _next_remind_weekly,
+    "monthly": _next_remind_monthly,
+}
 
 
 def _calculate_next_remind_time(current_remind_at: datetime, repeat_rule: Optional[str]) -> Optional[datetime]:
     """根据重复规则计算下一次提醒时间"""
     if not repeat_rule or not current_remind_at:
         return None
-    
-    if repeat_rule == "daily":
-        # 每天：加1天
-        return current_remind_at + timedelta(days=1)
-    elif repeat_rule == "workday":
-        # 工作日（周一至周五）：如果不是周五，加1天；如果是周五，跳到下周一
-        weekday = current_remind_at.weekday()  # 0=Monday, 4=Friday
-        if weekday < 4:  # Monday to Thursday
-            return current_remind_at + timedelta(days=1)
-        else:  # Friday
-            days_until_monday = 3  # Friday + 3 days = Monday
-            return current_remind_at + timedelta(days=days_until_monday)
-    elif repeat_rule == "weekly":
-        # 每周：加7天
-        return current_remind_at + timedelta(days=7)
-    elif repeat_rule == "monthly":
-        # 每月：加1个月
-        year = current_remind_at.year
-        month = current_remind_at.month
-        day = current_remind_at.day
-        hour = current_remind_at.hour
-        minute = current_remind_at.minute
-        second = current_remind_at.second
-        
-        # 处理月份加1
-        if month == 12:
-            year += 1
-            month = 1
-        else:
-            month += 1
-        
-        # 处理月末日期（如1月31日 -> 2月28日）
-        from calendar import monthrange
-        max_day = monthrange(year, month)[1]
-        day = min(day, max_day)
-        
-        return datetime(year, month, day, hour, minute, second)
-    
-    return None
+    func_next = _NEXT_REMIND_FUNCS.get(repeat_rule)
+    return func_next(current_remind_at) if func_next else None
 
 
 def mark_reminded(todo_id: int):
@@ -370,48 +715,62 @@ def mark_reminded(todo_id: int):
     4. 如果有重复规则，计算下一次提醒时间
     5. 周期性任务在凌晨会被 recover_failed_todos() 恢复
     """
-    with get_session() as s:
-        todo = s.execute(select(Todo).where(Todo.id == todo_id)).scalar_one_or_none()
-        if not todo:
-            return
-        
+    mark_reminded_bulk([todo_id])
+
+
+def mark_reminded_bulk(todo_ids: List[int], now: Optional[datetime] = None, session=None) -> int:
+    """批量标记待办为已提醒，规则同 mark_reminded。
+    所有待办的计数、状态和提醒时间用一条 UPDATE 完成，
+    重复任务各自的下一次提醒时间再用一次按主键的批量 UPDATE 写入。
+    返回更新的条数
+    """
+    if not todo_ids:
+        return 0
+    if now is None:
         now = datetime.now()
+    
+    with _session_scope(session) as s:
+        # 状态需要在 remind_count 自增之前计算（MySQL 按 SET 顺序求值）
+        result = s.execute(
+            update(Todo)
+            .where(Todo.id.in_(todo_ids))
+            .ordered_values(
+                (Todo.status, case((Todo.remind_count + 1 >= 3, "failed"), else_=Todo.status)),
+                (Todo.remind_count, Todo.remind_count + 1),
+                (Todo.reminded, True),
+                (Todo.last_remind_at, now),
+            )
+        )
         
-        # 更新提醒计数和时间
-        new_count = todo.remind_count + 1
-        
-        # 如果超过3次提醒仍未完成，标记为失败
-        if new_count >= 3:
-            status = 'failed'
-        else:
-            status = todo.status
-        
-        # 如果有重复规则，计算下一次提醒时间
-        if todo.repeat_rule and todo.remind_at:
-            next_remind_time = _calculate_next_remind_time(todo.remind_at, todo.repeat_rule)
-        else:
-            next_remind_time = None
-        
-        # 更新待办
-        update_dict = {
-            'reminded': True,
-            'remind_count': new_count,
-            'last_remind_at': now,
-            'status': status
-        }
-        
-        if next_remind_time:
-            update_dict['remind_at'] = next_remind_time
-            update_dict['reminded'] = False  # 重复任务重置提醒状态
+        # 重复任务：计算下一次提醒时间并重置提醒状态
+        repeat_rows = s.execute(
+            select(Todo.id, Todo.remind_at, Todo.repeat_rule).where(
+                Todo.id.in_(todo_ids),
+                Todo.repeat_rule != None,  # noqa: E711
+                Todo.remind_at != None,  # noqa: E711
+            )
+        ).all()
+        next_times = []
+        for todo_id, remind_at, repeat_rule in repeat_rows:
+            next_remind_time = _calculate_next_remind_time(remind_at, repeat_rule)
+            if next_remind_time:
+                next_times.append({"id": todo_id, "remind_at": next_remind_time, "reminded": False})
+        if next_times:
+            # ORM 按主键批量更新（executemany），不再逐条执行 UPDATE
+            s.execute(update(Todo), next_times)
         
-        s.execute(update(Todo).where(Todo.id == todo_id).values(**update_dict))
-        s.commit()
+        return result.rowcount
 
 
 
-def list_todos(user: User, status: Optional[str] = None, limit: int = 20) -> List[Todo]:
+def list_todos(user: User, status: Optional[str] = None, limit: int = 20, fields: Optional[tuple] = None) -> List[Todo]:
+    """列出用户的待办
+    fields: 只需展示部分字段时传入列，如 (Todo.id, Todo.title)，返回按列名访问的行而非 ORM 对象，
+    省去对象构建和 identity map 登记
+    """
     with get_session() as s:
-        stmt = select(Todo).where(Todo.user_id == user.id)
+        stmt = select(*fields) if fields else select(Todo)
+        stmt = stmt.where(Todo.user_id == user.id)
         if status:
             if status == "pending":
                 # "待办中"包含 pending 和 failed 状态
@@ -419,7 +778,34 @@ def list_todos(user: User, status: Optional[str] = None, limit: int = 20) -> Lis
             else:
                 stmt = stmt.where(Todo.status == status)
         stmt = stmt.order_by(Todo.created_at.desc()).limit(limit)
-        return s.execute(stmt).scalars().all()
+        result = s.execute(stmt)
+        return result.all() if fields else result.scalars().all()
+
+
+def get_todo(user: User, todo_id: int) -> Optional[Todo]:
+    """按主键获取用户的一条待办，不存在或不属于该用户时返回 None"""
+    with get_session() as s:
+        todo = s.get(Todo, todo_id)
+        if todo is None or todo.user_id != user.id:
+            return None
+        return todo
+
+
+def _supports_returning(s) -> bool:
+    """数据库是否支持 UPDATE/DELETE ... RETURNING（PostgreSQL、SQLite 3.35+ 支持，MySQL 不支持）"""
+    dialect = s.get_bind().dialect
+    return dialect.update_returning and dialect.delete_returning
+
+
+def _completion_values(now: datetime) -> dict:
+    """完成待办时的字段更新（按行区分）：重复任务只重置提醒计数，非重复任务标记为完成"""
+    is_repeat = Todo.repeat_rule != None  # noqa: E711
+    return {
+        "status": case((is_repeat, "pending"), else_="done"),
+        "remind_count": case((is_repeat, 0), else_=Todo.remind_count),
+        "last_remind_at": case((is_repeat, None), else_=Todo.last_remind_at),
+        "completed_at": case((is_repeat, Todo.completed_at), else_=now),
+    }
 
 
 def complete_todo(user: User, todo_id: int) -> Tuple[bool, str]:
@@ -427,6 +813,22 @@ def complete_todo(user: User, todo_id: int) -> Tuple[bool, str]:
     重复任务不能被彻底完成，只能重置提醒计数
     """
     with get_session() as s:
+        if _supports_returning(s):
+            # 一条 UPDATE ... RETURNING 完成两种任务的状态变更，省去先查询的往返
+            row = s.execute(
+                update(Todo)
+                .where(Todo.id == todo_id, Todo.user_id == user.id, Todo.status != "done")
+                .values(**_completion_values(datetime.now()))
+                .returning(Todo.title, Todo.repeat_rule)
+            ).first()
+            if row:
+                s.commit()
+                title, repeat_rule = row
+                return True, f"已确认：{title}（明日继续提醒）" if repeat_rule else f"已完成：{title}"
+            # 未更新：待办不存在或已完成
+            exists = s.execute(select(Todo.id).where(Todo.id == todo_id, Todo.user_id == user.id)).first()
+            return (True, "该待办已完成") if exists else (False, "未找到该待办")
+        
         t = s.execute(select(Todo).where(Todo.id == todo_id, Todo.user_id == user.id)).scalar_one_or_none()
         if not t:
             return False, "未找到该待办"
@@ -448,12 +850,27 @@ def complete_todo(user: User, todo_id: int) -> Tuple[bool, str]:
         return True, f"已完成：{t.title}"
 
 
+def complete_todos_bulk(user: User, todo_ids: List[int], session=None) -> int:
+    """批量完成待办，规则同 complete_todo，一条 UPDATE 完成
+    返回更新的条数
+    """
+    if not todo_ids:
+        return 0
+    with _session_scope(session) as s:
+        result = s.execute(
+            update(Todo)
+            .where(Todo.id.in_(todo_ids), Todo.user_id == user.id, Todo.status != "done")
+            .values(**_completion_values(datetime.now()))
+        )
+        return result.rowcount
+
+
 def delete_todo(user: User, todo_id: int) -> Tuple[bool, str]:
     with get_session() as s:
-        t = s.execute(select(Todo).where(Todo.id == todo_id, Todo.user_id == user.id)).scalar_one_or_none()
-        if not t:
+        # 直接按 id + user_id 删除，根据影响行数判断是否存在，无需先查询
+        result = s.execute(delete(Todo).where(Todo.id == todo_id, Todo.user_id == user.id))
+        if not result.rowcount:
             return False, "未找到该待办"
-        s.execute(delete(Todo).where(Todo.id == todo_id))
         s.commit()
         return True, "已删除"
 
@@ -464,7 +881,7 @@ def edit_todo(user: User, todo_id: int, new_title: Optional[str] = None, new_tim
         if not t:
             return False, "未找到该待办"
         if new_title is not None:
-            t.title = new_title[:128]
+            t.title = _normalize_title(new_title)
         if clear_remind:
             # 明确清除提醒时间
             t.remind_at = None
@@ -473,6 +890,7 @@ def edit_todo(user: User, todo_id: int, new_title: Optional[str] = None, new_tim
             t.remind_at = new_time
             t.reminded = False
         s.commit()
+        _mark_todos_changed()
         when = t.remind_at.strftime("%Y-%m-%d %H:%M") if t.remind_at else "未设置"
         return True, f"已更新：{t.title}（提醒：{when}）"
 
@@ -485,13 +903,14 @@ def update_todo(user: User, todo_id: int, title: Optional[str] = None, remind_at
         if not t:
             return False, "未找到该待办"
         if title is not None:
-            t.title = title[:128]
+            t.title = _normalize_title(title)
         if remind_at is not None:
             t.remind_at = remind_at
             t.reminded = False
         if repeat_rule is not None:
             t.repeat_rule = repeat_rule
         s.commit()
+        _mark_todos_changed()
         when = t.remind_at.strftime("%Y-%m-%d %H:%M") if t.remind_at else "未设置提醒"
         repeat_text = f"（重复：{repeat_rule}）" if repeat_rule else ""
         return True, f"已更新：{t.title}（提醒：{when}{repeat_text}）"
@@ -526,45 +945,49 @@ def undo_todo(user: User, todo_id: int) -> Tuple[bool, str]:
         )
         s.add(new_todo)
         s.commit()
+        _mark_todos_changed()
         s.refresh(new_todo)
         
         return True, f"已恢复为待办：{title}"
 
 
 # ---- Stats helpers ----
+# 以下区间均为左闭右开 [start, end)，查询使用 >= start AND < end
+
+
 def _day_bounds(dt: datetime) -> Tuple[datetime, datetime]:
-    start = datetime(dt.year, dt.month, dt.day, 0, 0, 0)
-    end = datetime(dt.year, dt.month, dt.day, 23, 59, 59)
-    return start, end
+    start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
 
 
 def _week_bounds(dt: datetime) -> Tuple[datetime, datetime]:
     # Monday is 0
-    weekday = dt.weekday()
-    start = datetime(dt.year, dt.month, dt.day, 0, 0, 0) - timedelta(days=weekday)
-    end = start + timedelta(days=6, hours=23, minutes=59, seconds=59)
-    return start, end
+    start = dt.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=dt.weekday())
+    return start, start + timedelta(days=7)
 
 
 def _month_bounds(dt: datetime) -> Tuple[datetime, datetime]:
-    from calendar import monthrange
-    last_day = monthrange(dt.year, dt.month)[1]
-    start = datetime(dt.year, dt.month, 1, 0, 0, 0)
-    end = datetime(dt.year, dt.month, last_day, 23, 59, 59)
+    start = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if dt.month == 12:
+        end = start.replace(year=dt.year + 1, month=1)
+    else:
+        end = start.replace(month=dt.month + 1)
     return start, end
 
 
 def sum_expenses_between(user: User, start: datetime, end: datetime) -> float:
+    """统计 [start, end) 区间内的支出"""
     with get_session() as s:
         total = s.execute(
             select(func.coalesce(func.sum(Expense.amount), 0)).where(
                 Expense.user_id == user.id,
                 Expense.spent_at >= start,
-                Expense.spent_at <= end,
+                Expense.spent_at < end,
             )
         ).scalar_one()
         try:
-            return float(total)
+            # amount 以分存储
+            return int(total) / 100.0
         except Exception:
             return 0.0
 
@@ -599,7 +1022,7 @@ def list_todos_for_day(user: User, day: Optional[datetime] = None) -> List[Todo]
                 Todo.status == "pending",
                 Todo.remind_at != None,  # noqa: E711
                 Todo.remind_at >= start,
-                Todo.remind_at <= end,
+                Todo.remind_at < end,
             )
             .order_by(Todo.remind_at.asc(), Todo.created_at.asc())
             .limit(50)
@@ -607,32 +1030,40 @@ def list_todos_for_day(user: User, day: Optional[datetime] = None) -> List[Todo]
         return s.execute(stmt).scalars().all()
 
 
-def recover_failed_todos():
+def recover_failed_todos(session=None):
     """凌晨自动恢复失败状态的任务（仅重复任务）"""
-    with get_session() as s:
-        # 查找所有失败状态的重复任务
-        failed_todos = s.execute(
-            select(Todo).where(
+    with _session_scope(session) as s:
+        # 一条 UPDATE 把失败的重复任务重置为待办状态，不需要把行加载到内存
+        result = s.execute(
+            update(Todo).where(
                 Todo.status == "failed",
                 Todo.repeat_rule != None  # noqa: E711
-            )
-        ).scalars().all()
-        
-        for todo in failed_todos:
-            # 重置为待办状态
-            todo.status = "pending"
-            todo.remind_count = 0
-            todo.last_remind_at = None
-            # 提醒状态在 mark_reminded 时处理
-            todo.reminded = False
-        
-        s.commit()
-        return len(failed_todos)
+            ).values(status="pending", remind_count=0, last_remind_at=None, reminded=False)
+        )
+        count = result.rowcount
+        if count:
+            _on_commit(s, _mark_todos_changed)
+        return count
 
 
 def reset_failed_todo(user: User, todo_id: int) -> Tuple[bool, str]:
     """手动重置失败状态的待办为待办中"""
     with get_session() as s:
+        if _supports_returning(s):
+            title = s.execute(
+                update(Todo)
+                .where(Todo.id == todo_id, Todo.user_id == user.id, Todo.status == "failed")
+                .values(status="pending", remind_count=0, last_remind_at=None, reminded=False)
+                .returning(Todo.title)
+            ).scalar()
+            if title is not None:
+                s.commit()
+                _mark_todos_changed()
+                return True, f"已重置：{title}"
+            # 未更新：待办不存在或状态不是失败
+            exists = s.execute(select(Todo.id).where(Todo.id == todo_id, Todo.user_id == user.id)).first()
+            return (False, "该待办状态不是失败") if exists else (False, "未找到该待办")
+        
         t = s.execute(select(Todo).where(Todo.id == todo_id, Todo.user_id == user.id)).scalar_one_or_none()
         if not t:
             return False, "未找到该待办"
@@ -644,6 +1075,7 @@ def reset_failed_todo(user: User, todo_id: int) -> Tuple[bool, str]:
         t.last_remind_at = None
         t.reminded = False
         s.commit()
+        _mark_todos_changed()
         return True, f"已重置：{t.title}"
 
 
@@ -654,18 +1086,19 @@ def complete_recently_reminded_todos(user: User) -> Tuple[bool, str]:
     优先处理失败状态的待办（提醒三次后的任务）
     """
     with get_session() as s:
-        # 优先查询失败状态的待办（提醒三次后的任务）
-        failed_stmt = (
+        # 失败状态（提醒三次后的任务）与最近提醒的待办状态一条查询取回，失败状态排在前面
+        stmt = (
             select(Todo)
             .where(
                 Todo.user_id == user.id,
-                Todo.status == "failed",
+                Todo.status.in_(("failed", "pending")),
                 Todo.last_remind_at != None  # noqa: E711
             )
-            .order_by(Todo.last_remind_at.desc())
+            .order_by(case((Todo.status == "failed", 0), else_=1), Todo.last_remind_at.desc())
             .limit(50)
         )
-        failed_todos = list(s.execute(failed_stmt).scalars().all())
+        rows = list(s.execute(stmt).scalars().all())
+        failed_todos = [todo for todo in rows if todo.status == "failed"]
         
         # 如果找到失败状态的待办，优先处理这些
         if failed_todos:
@@ -695,30 +1128,21 @@ def complete_recently_reminded_todos(user: User) -> Tuple[bool, str]:
                 else:
                     return True, f"已完成 {completed_count} 条待办：{', '.join(completed_titles[:3])}{'...' if len(completed_titles) > 3 else ''}"
         
-        # 如果没有失败状态的待办，查询最近被提醒的待办（status='pending'）
-        pending_stmt = (
-            select(Todo)
-            .where(
-                Todo.user_id == user.id,
-                Todo.status == "pending",
-                Todo.last_remind_at != None  # noqa: E711
-            )
-            .order_by(Todo.last_remind_at.desc())
-            .limit(50)
-        )
-        todos = list(s.execute(pending_stmt).scalars().all())
+        # 如果没有失败状态的待办，处理最近被提醒的待办（status='pending'）
+        todos = rows
         
         if not todos:
             return False, "没有找到最近提醒的待办"
         
-        # 找出最新的提醒时间（第一条记录的 last_remind_at）
-        latest_remind_time = todos[0].last_remind_at
+        # 找出最新的提醒时间（第一条记录的 last_remind_at），截断到秒只做一次
+        latest_second = todos[0].last_remind_at.replace(microsecond=0)
+        next_second = latest_second + timedelta(seconds=1)
         
         # 找出所有与最新提醒时间相同（精确到秒）的待办
-        # 由于 last_remind_at 是 datetime，我们需要比较到秒级别
+        # 用落在 [latest_second, next_second) 区间判断，不必为每条记录再构造新的 datetime
         same_time_todos = [
             todo for todo in todos
-            if todo.last_remind_at and todo.last_remind_at.replace(microsecond=0) == latest_remind_time.replace(microsecond=0)
+            if todo.last_remind_at and latest_second <= todo.last_remind_at < next_second
         ]
         
         # 完成这些待办（在同一事务中处理）
@@ -9,11 +9,42 @@
 import requests
 import json
 import os
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
 from typing import Optional, Tuple, Dict, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from common import json_utils
 from common.log import logger
 
 
+@lru_cache(maxsize=None)
+def _weather_http() -> requests.Session:
+    """天气模块共用的 HTTP 会话（高德天气接口与 AI 建议接口），复用 TLS 连接；GET 遇到网关偶发的 5xx 时在连接池内重试"""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# 天气数据短时缓存：同一城市在有效期内的多次查询（如给多个用户发送早报）只请求一次接口
+_WEATHER_TTL = 600
+_weather_cache: Dict[str, Tuple[float, dict]] = {}
+_weather_cache_lock = threading.Lock()
+
+# AI 建议缓存：同一天内天气要素相同则建议相同，多个用户共用一次 LLM 调用
+_advice_cache: Dict[tuple, Tuple[date, str]] = {}
+_advice_cache_lock = threading.Lock()
+
+# 星期映射（高德接口 week 字段为 "1"~"7"）
+_WEEK_MAP = {"1": "周一", "2": "周二", "3": "周三", "4": "周四", "5": "周五", "6": "周六", "7": "周日"}
+
+
 class WeatherService:
     def __init__(self, api_key: str):
         """
@@ -22,6 +53,10 @@ class WeatherService:
         """
         self.api_key = api_key
         self.base_url = "https://restapi.amap.com/v3/weather/weatherInfo"
+        self._params_base = {
+            'key': api_key,
+            'extensions': 'all'  # 获取预报天气
+        }
     
     def get_weather(self, adcode: str = "510116") -> Optional[dict]:
         """
@@ -29,27 +64,30 @@ class WeatherService:
         :param adcode: 城市编码，默认510116（成都市双流区）
         :return: 天气数据字典
         """
+        with _weather_cache_lock:
+            cached = _weather_cache.get(adcode)
+        if cached and time.monotonic() - cached[0] < _WEATHER_TTL:
+            return cached[1]
+        
         try:
-            params = {
-                'key': self.api_key,
-                'city': adcode,
-                'extensions': 'all'  # 获取预报天气
-            }
+            params = {**self._params_base, 'city': adcode}
             
-            response = requests.get(self.base_url, params=params, timeout=10)
+            response = _weather_http().get(self.base_url, params=params, timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            data = json_utils.loads(response.content)
             
             if data.get('status') == '1':
-                logger.info(f"[Weather] Successfully fetched weather for city {adcode}")
+                logger.info("[Weather] Successfully fetched weather for city %s", adcode)
+                with _weather_cache_lock:
+                    _weather_cache[adcode] = (time.monotonic(), data)
                 return data
             else:
-                logger.error(f"[Weather] API error: {data.get('info')} (code: {data.get('infocode')})")
+                logger.error("[Weather] API error: %s (code: %s)", data.get('info'), data.get('infocode'))
                 return None
                 
         except Exception as e:
-            logger.error(f"[Weather] Failed to fetch weather: {e}")
+            logger.error("[Weather] Failed to fetch weather: %s", e)
             return None
     
     def format_weather_report(self, weather_data: dict) -> Optional[str]:
@@ -76,29 +114,32 @@ class WeatherService:
             # 今天的天气
             today = casts[0]
             
-            # 星期映射
-            week_map = {"1": "周一", "2": "周二", "3": "周三", "4": "周四", "5": "周五", "6": "周六", "7": "周日"}
             today_week_num = today.get('week', '')
-            today_week_name = week_map.get(today_week_num, today_week_num)
+            today_week_name = _WEEK_MAP.get(today_week_num, today_week_num)
             
-            report = f"📍 {city} 天气预报\n\n"
-            report += f"📅 日期：{today.get('date')} {today_week_name}\n"
-            report += f"☀️ 白天：{today.get('dayweather')} {today.get('daytemp')}°C {today.get('daywind')}风 {today.get('daypower')}级\n"
-            report += f"🌙 夜间：{today.get('nightweather')} {today.get('nighttemp')}°C {today.get('nightwind')}风 {today.get('nightpower')}级\n\n"
+            # 逐行收集后一次拼接，空字符串对应空行
+            lines = [
+                f"📍 {city} 天气预报",
+                "",
+                f"📅 日期：{today.get('date')} {today_week_name}",
+                f"☀️ 白天：{today.get('dayweather')} {today.get('daytemp')}°C {today.get('daywind')}风 {today.get('daypower')}级",
+                f"🌙 夜间：{today.get('nightweather')} {today.get('nighttemp')}°C {today.get('nightwind')}风 {today.get('nightpower')}级",
+                "",
+            ]
             
             # 未来3天预报
             if len(casts) > 1:
-                report += "📊 未来预报：\n"
-                week_map = {"1": "周一", "2": "周二", "3": "周三", "4": "周四", "5": "周五", "6": "周六", "7": "周日"}
+                lines.append("📊 未来预报：")
                 for cast in casts[1:4]:  # 显示未来3天
                     week_num = cast.get('week', '')
-                    week_name = week_map.get(week_num, week_num)
-                    report += f"{cast.get('date')} {week_name}：{cast.get('dayweather')} {cast.get('daytemp')}~{cast.get('nighttemp')}°C\n"
+                    week_name = _WEEK_MAP.get(week_num, week_num)
+                    lines.append(f"{cast.get('date')} {week_name}：{cast.get('dayweather')} {cast.get('daytemp')}~{cast.get('nighttemp')}°C")
             
-            return report
+            lines.append("")
+            return "\n".join(lines)
             
         except Exception as e:
-            logger.error(f"[Weather] Failed to format weather report: {e}")
+            logger.error("[Weather] Failed to format weather report: %s", e)
             return None
     
     def generate_ai_advice(self, weather_data: dict, openai_client) -> Optional[str]:
@@ -121,6 +162,15 @@ class WeatherService:
                 return None
             
             today = casts[0]
+            model = openai_client.get('model') or 'gpt-3.5-turbo'
+            
+            cache_key = (today.get('dayweather'), today.get('daytemp'), today.get('nighttemp'),
+                         today.get('daywind'), today.get('daypower'), model)
+            cur_date = date.today()
+            with _advice_cache_lock:
+                cached = _advice_cache.get(cache_key)
+            if cached and cached[0] == cur_date:
+                return cached[1]
             
             # 构建提示词
             prompt = f"""根据以下天气信息，给出简洁实用的生活建议（3-5条）：
@@ -140,28 +190,36 @@ class WeatherService:
 - 简洁明了，每条不超过20字
 - 只输出建议内容，不要额外说明"""
 
-            import openai
-            
-            openai.api_key = openai_client['api_key']
-            if openai_client.get('api_base'):
-                openai.api_base = openai_client['api_base']
-            
-            response = openai.ChatCompletion.create(
-                model=openai_client.get('model', 'gpt-3.5-turbo'),
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=200
+            # 直接请求 chat/completions 接口并复用长连接，不修改 openai 模块的全局配置，多线程下也安全
+            api_base = (openai_client.get('api_base') or "https://api.openai.com/v1").rstrip("/")
+            response = _weather_http().post(
+                f"{api_base}/chat/completions",
+                headers={"Authorization": f"Bearer {openai_client['api_key']}"},
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": 0.7,
+                    "max_tokens": 200
+                },
+                timeout=(3, 30)
             )
+            response.raise_for_status()
+            
+            advice = json_utils.loads(response.content)['choices'][0]['message']['content'].strip()
+            logger.info("[Weather] Generated AI advice: %s", advice)
             
-            advice = response['choices'][0]['message']['content'].strip()
-            logger.info(f"[Weather] Generated AI advice: {advice}")
+            with _advice_cache_lock:
+                # 只保留当天的建议，旧日期的条目顺带清理
+                for key in [k for k, v in _advice_cache.items() if v[0] != cur_date]:
+                    del _advice_cache[key]
+                _advice_cache[cache_key] = (cur_date, advice)
             
             return advice
             
         except Exception as e:
-            logger.error(f"[Weather] Failed to generate AI advice: {e}")
+            logger.error("[Weather] Failed to generate AI advice: %s", e)
             return None
     
 
@@ -220,7 +278,42 @@ def send_daily_weather(send_func, user_id: str, api_key: str, openai_config: Opt
         )
         
         send_func(user_id, message)
-        logger.info(f"[Weather] Sent daily weather to user {user_id}")
+        logger.info("[Weather] Sent daily weather to user %s", user_id)
+    except Exception as e:
+        logger.error("[Weather] Failed to send daily weather: %s", e)
+
+
+def send_daily_weather_batch(send_func, user_ids: List[str], api_key: str, openai_config: Optional[dict] = None,
+                             max_workers: int = 16):
+    """
+    向多个用户发送每日天气预报
+    所有用户共用同一城市，天气消息（含 AI 建议）只生成一次，发送在线程池中并发进行
+    :param send_func: 发送消息的函数
+    :param user_ids: 用户ID列表
+    :param api_key: 高德地图API Key
+    :param openai_config: OpenAI配置
+    :param max_workers: 并发发送的线程数
+    """
+    if not user_ids:
+        return
+    if len(user_ids) == 1:
+        send_daily_weather(send_func, user_ids[0], api_key, openai_config)
+        return
+    
+    try:
+        message = WeatherService(api_key).get_complete_weather_message("510116", openai_config)
     except Exception as e:
-        logger.error(f"[Weather] Failed to send daily weather: {e}")
+        logger.error("[Weather] Failed to build daily weather: %s", e)
+        return
+    
+    def _send_one(user_id: str):
+        try:
+            send_func(user_id, message)
+            logger.info("[Weather] Sent daily weather to user %s", user_id)
+        except Exception as e:
+            logger.error("[Weather] Failed to send daily weather to user %s: %s", user_id, e)
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(user_ids)), thread_name_prefix="weather-send") as pool:
+        for user_id in user_ids:
+            pool.submit(_send_one, user_id)
 
@@ -13,6 +13,9 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.api_balance_service import get_balance_service
 
+# 本插件处理的消息只可能以这些字符开头（#余额 / sk-xxx）
+_PREFIXES = ("#", "s")
+
 
 @plugins.register(
     name="api_balance",
@@ -32,15 +35,23 @@ class APIBalancePlugin(Plugin):
         if context.type != ContextType.TEXT:
             return
         
-        text = str(context.content).strip()
+        content = str(context.content)
+        if not content:
+            return
+        # 绝大多数消息与本插件无关：首字符既不是命令前缀也不是空白时直接返回，不做 strip
+        first = content[0]
+        if first not in _PREFIXES and not first.isspace():
+            return
+        
+        text = content.strip()
         
         # 处理 #余额 命令
         if text.startswith("#余额"):
             self._handle_balance_query(e_context)
             return
         
-        # 处理更新API KEY命令（检测是否是以sk-开头的长字符串）
-        if text.startswith("sk-") and len(text) > 40:
+        # 处理更新API KEY命令（检测是否是以sk-开头的长字符串），先做更便宜的长度判断
+        if len(text) > 40 and text[:3] == "sk-":
             self._handle_api_key_update(e_context, text)
             return
     
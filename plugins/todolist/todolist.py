@@ -1,16 +1,67 @@
-import re
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
 
 import plugins
 from plugins import Plugin
 from plugins.event import Event, EventAction, EventContext
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.db import get_session
 from common.log import logger
-from common.service import ensure_user, list_todos, complete_todo, delete_todo, create_todo, _parse_at
+from common.models import Todo, User
+from common.service import (
+    ensure_user, list_todos, get_todo, complete_todo, complete_todos_bulk, delete_todo, create_todo_for_text,
+    reminded_recently,
+)
 from config import conf
 
 
+# 进程内的用户缓存：聊天用户对应的 User 记录基本不变，命中后无需再访问数据库
+_USER_CACHE: Dict[str, User] = {}
+_USER_CACHE_LOCK = threading.Lock()
+
+
+def _get_user(user_id: str, nickname: Optional[str], session=None) -> User:
+    """获取（必要时创建）用户，昵称变化时重新走 ensure_user 更新并刷新缓存
+    传入 session 时由调用方提交，此时不写入缓存，避免缓存未提交成功的用户
+    """
+    with _USER_CACHE_LOCK:
+        user = _USER_CACHE.get(user_id)
+    if user is not None and (not nickname or user.nickname == nickname):
+        return user
+    user = ensure_user(user_id, nickname, session=session)
+    if session is None:
+        with _USER_CACHE_LOCK:
+            _USER_CACHE[user_id] = user
+    return user
+
+
+def _split_command(text: str) -> Tuple[str, str]:
+    """解析 #todo <command> <arg>，与 text.split(None, 2) 的切分结果一致（任意空白分隔，含全角空格、制表符）"""
+    rest = text[5:]  # len("#todo")
+    if not rest or rest[0].isspace():
+        # 去掉 "#todo" 后只需切一次，不必再扫描前缀
+        parts = rest.split(None, 1)
+    else:
+        # "#todoxxx ..." 这类前缀后未空格的写法保持原有的切分方式
+        parts = text.split(None, 2)[1:]
+    command = parts[0] if parts else ""
+    arg = parts[1] if len(parts) > 1 else ""
+    return command, arg
+
+
+# #todo 子命令 -> 处理方法名，在插件初始化时绑定为实例方法
+_COMMANDS = {
+    "list": "_cmd_list", "ls": "_cmd_list", "列表": "_cmd_list",
+    "done": "_cmd_done", "完成": "_cmd_done",
+    "del": "_cmd_del", "rm": "_cmd_del", "删除": "_cmd_del",
+    "break": "_cmd_break", "breakdown": "_cmd_break", "拆分": "_cmd_break",
+}
+
+
 @plugins.register(
     name="todolist",
     desire_priority=1999,
@@ -23,6 +74,7 @@ class TodoListPlugin(Plugin):
     def __init__(self):
         super().__init__()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+        self._cmd_map = {name: getattr(self, method) for name, method in _COMMANDS.items()}
 
     def on_handle_context(self, e_context: EventContext):
         context = e_context["context"]
@@ -34,84 +86,30 @@ class TodoListPlugin(Plugin):
         # 检查是否是批量完成指令（单个数字或“扣1”等快捷词）
         digit = self._extract_digit_command(text)
         if digit is not None:
-            self._handle_batch_complete(e_context, digit)
+            # 最近 5 分钟内没有给该用户发过提醒时不查询数据库，消息交给后续处理
+            msg = context["msg"]
+            user_id = getattr(msg, "other_user_id", getattr(msg, "from_user_id", "unknown"))
+            if reminded_recently(user_id, within=300):
+                self._handle_batch_complete(e_context, digit)
             return
         
         # 只处理 #todo 开头的消息
         if not text.startswith("#todo"):
             return
 
-        # 确保用户存在
+        # 用户在各命令分支中获取；创建待办时与待办写入共用一个会话
         msg = context["msg"]
         user_id = getattr(msg, "other_user_id", getattr(msg, "from_user_id", "unknown"))
-        user = ensure_user(user_id, getattr(msg, "other_user_nickname", None))
+        nickname = getattr(msg, "other_user_nickname", None)
 
-        # 解析命令
-        parts = text.split(None, 2)  # 最多分成3部分
-        command = parts[1] if len(parts) > 1 else ""
-        arg = parts[2] if len(parts) > 2 else ""
+        # 解析命令：#todo <command> <arg>
+        command, arg = _split_command(text)
 
         reply = Reply()
-        logger.info(f"[TodoList] Batch complete command '{digit}' from user {user_id}")
-        
-        # 处理不同命令
-        if command.lower() in ("list", "ls", "列表"):
-            # 查看列表
-            status = arg.lower() if arg else "pending"
-            if status == "all":
-                status = None
-            
-            todos = list_todos(user, status=status, limit=20)
-            
-            if not todos:
-                reply.type = ReplyType.TEXT
-                reply.content = "📋 暂无待办事项"
-            else:
-                lines = ["📋 待办列表："]
-                for t in todos:
-                    status_emoji = "✅" if t.status == "done" else "⏳"
-                    when = t.remind_at.strftime("%m-%d %H:%M") if t.remind_at else ""
-                    time_str = f" ({when})" if when else ""
-                    lines.append(f"{status_emoji} {t.id}. {t.title}{time_str}")
-                reply.type = ReplyType.TEXT
-                reply.content = "\n".join(lines)
-        
-        elif command.lower() in ("done", "完成") and arg:
-            # 完成待办
-            todo_id = int(arg)
-            ok, msg_text = complete_todo(user, todo_id)
-            reply.type = ReplyType.TEXT if ok else ReplyType.ERROR
-            reply.content = msg_text
         
-        elif command.lower() in ("del", "rm", "删除") and arg:
-            # 删除待办
-            todo_id = int(arg)
-            ok, msg_text = delete_todo(user, todo_id)
-            reply.type = ReplyType.TEXT if ok else ReplyType.ERROR
-            reply.content = msg_text
-        
-        elif command.lower() in ("break", "breakdown", "拆分"):
-            # 拆解待办（仅显示建议）
-            if arg:
-                try:
-                    todo_id = int(arg)
-                    todos = list_todos(user, limit=100)
-                    todo = next((t for t in todos if t.id == todo_id), None)
-                    
-                    if todo:
-                        reply.type = ReplyType.TEXT
-                        reply.content = f"📝 待办拆解建议（{todo.title}）：\n\n1. 准备工作\n2. 执行步骤\n3. 检查完成\n\n💡 这只是建议，不会保存"
-                    else:
-                        reply.type = ReplyType.ERROR
-                        reply.content = "未找到该待办"
-                except ValueError:
-                    reply.type = ReplyType.ERROR
-                    reply.content = "无效的待办ID"
-            else:
-                reply.type = ReplyType.ERROR
-                reply.content = "请指定待办ID，例如：#todo break 1"
-        
-        else:
+        # 处理不同命令：查表分发，命令不匹配或处理方法不适用（返回 False）时按创建待办处理
+        handler = self._cmd_map.get(command.lower())
+        if handler is None or not handler(user_id, nickname, arg, reply):
             # 创建待办或显示帮助
             if not command and not arg:
                 # 空的 #todo 命令，显示帮助
@@ -120,20 +118,105 @@ class TodoListPlugin(Plugin):
             else:
                 # 创建待办
                 # 合并 command 和 arg 作为完整内容
-                full_content = text[len("#todo"):].strip()
-                body, remind_time = _parse_at(full_content)
-                
-                if not body.strip():
-                    reply.type = ReplyType.ERROR
-                    reply.content = "待办内容不能为空"
-                else:
-                    ok, result = create_todo(user, body.strip(), remind_time)
-                    reply.type = ReplyType.TEXT if ok else ReplyType.ERROR
-                    reply.content = result
+                full_content = text[5:].strip()
+                # 需要 LLM 识别时间时先创建待办并立即回复，识别结果再单独发送一条消息
+                notify = self._make_notifier(e_context)
+                # 获取用户和写入待办在同一事务中完成，只提交一次
+                with get_session() as s:
+                    user = _get_user(user_id, nickname, session=s)
+                    ok, result = create_todo_for_text(user, full_content, session=s, notify=notify)
+                    s.commit()
+                reply.type = ReplyType.TEXT if ok else ReplyType.ERROR
+                reply.content = result
 
         e_context["reply"] = reply
         e_context.action = EventAction.BREAK_PASS
 
+    def _cmd_list(self, user_id: str, nickname: Optional[str], arg: str, reply: Reply) -> bool:
+        """查看列表"""
+        status = arg.lower() if arg else "pending"
+        if status == "all":
+            status = None
+        
+        user = _get_user(user_id, nickname)
+        # 列表只展示这几个字段，直接取列即可
+        todos = list_todos(user, status=status, limit=20,
+                           fields=(Todo.id, Todo.title, Todo.remind_at, Todo.status))
+        
+        if not todos:
+            reply.type = ReplyType.TEXT
+            reply.content = "📋 暂无待办事项"
+        else:
+            lines = ["📋 待办列表："]
+            for t in todos:
+                status_emoji = "✅" if t.status == "done" else "⏳"
+                d = t.remind_at
+                # 直接格式化各字段，等价于 strftime("%m-%d %H:%M")，开销更小
+                time_str = f" ({d.month:02d}-{d.day:02d} {d.hour:02d}:{d.minute:02d})" if d else ""
+                lines.append(f"{status_emoji} {t.id}. {t.title}{time_str}")
+            reply.type = ReplyType.TEXT
+            reply.content = "\n".join(lines)
+        return True
+
+    def _cmd_done(self, user_id: str, nickname: Optional[str], arg: str, reply: Reply) -> bool:
+        """完成待办，未给出 ID 时不处理"""
+        if not arg:
+            return False
+        todo_id = int(arg)
+        user = _get_user(user_id, nickname)
+        ok, msg_text = complete_todo(user, todo_id)
+        reply.type = ReplyType.TEXT if ok else ReplyType.ERROR
+        reply.content = msg_text
+        return True
+
+    def _cmd_del(self, user_id: str, nickname: Optional[str], arg: str, reply: Reply) -> bool:
+        """删除待办，未给出 ID 时不处理"""
+        if not arg:
+            return False
+        todo_id = int(arg)
+        user = _get_user(user_id, nickname)
+        ok, msg_text = delete_todo(user, todo_id)
+        reply.type = ReplyType.TEXT if ok else ReplyType.ERROR
+        reply.content = msg_text
+        return True
+
+    def _cmd_break(self, user_id: str, nickname: Optional[str], arg: str, reply: Reply) -> bool:
+        """拆解待办（仅显示建议）"""
+        if arg:
+            try:
+                todo_id = int(arg)
+                user = _get_user(user_id, nickname)
+                todo = get_todo(user, todo_id)
+                
+                if todo:
+                    reply.type = ReplyType.TEXT
+                    reply.content = f"📝 待办拆解建议（{todo.title}）：\n\n1. 准备工作\n2. 执行步骤\n3. 检查完成\n\n💡 这只是建议，不会保存"
+                else:
+                    reply.type = ReplyType.ERROR
+                    reply.content = "未找到该待办"
+            except ValueError:
+                reply.type = ReplyType.ERROR
+                reply.content = "无效的待办ID"
+        else:
+            reply.type = ReplyType.ERROR
+            reply.content = "请指定待办ID，例如：#todo break 1"
+        return True
+
+    def _make_notifier(self, e_context: EventContext):
+        """返回向当前会话追加发送文本消息的函数，渠道不可用时返回 None"""
+        channel = e_context.econtext.get("channel")
+        if channel is None:
+            return None
+        context = e_context["context"]
+        
+        def notify(text: str):
+            reply = Reply()
+            reply.type = ReplyType.TEXT
+            reply.content = text
+            channel.send(reply, context)
+        
+        return notify
+
     def _extract_digit_command(self, text: str):
         """
         提取批量完成指令中的数字。
@@ -142,39 +225,33 @@ class TodoListPlugin(Plugin):
           - "扣1"
           - "按1"
         只要整段文字里仅出现一个数字且无其他数字即可识别。
+        超过 8 个字符的消息视为普通聊天，直接跳过。
         """
         stripped = text.strip()
-        if not stripped:
+        if not stripped or len(stripped) > 8:
             return None
         
-        # 完全是单个数字
-        if stripped.isdigit() and len(stripped) == 1:
-            return stripped
-        
-        # 允许前缀包含非数字字符，例如“扣1”“按1”
-        match = re.fullmatch(r"[^\d]*([0-9])[^\d]*", stripped)
-        if match:
-            # 确保只包含一个数字
-            digits = re.findall(r"\d", stripped)
-            if len(digits) == 1:
-                return match.group(1)
-        return None
+        # 单次扫描：记住唯一出现的数字，出现第二个数字即不是快捷指令
+        digit = None
+        for ch in stripped:
+            if ch.isdecimal():
+                if digit is not None:
+                    return None
+                digit = ch
+        if digit is None or digit not in "0123456789":
+            return None
+        return digit
 
     def _handle_batch_complete(self, e_context: EventContext, digit: str):
         """处理批量完成：回复单个数字完成最近的多个提醒"""
         context = e_context["context"]
         msg = context["msg"]
         user_id = getattr(msg, "other_user_id", getattr(msg, "from_user_id", "unknown"))
-        user = ensure_user(user_id, getattr(msg, "other_user_nickname", None))
+        user = _get_user(user_id, getattr(msg, "other_user_nickname", None))
         
         reply = Reply()
         
         try:
-            from datetime import timedelta
-            from common.db import get_session
-            from common.models import Todo
-            from sqlalchemy import select
-            
             # 查找最近5分钟内应该提醒的待办（还未完成的）
             now = datetime.now()
             time_window_start = now - timedelta(minutes=5)
@@ -198,20 +275,15 @@ class TodoListPlugin(Plugin):
                 if not recent_todos:
                     reply.type = ReplyType.TEXT
                     reply.content = "ℹ️ 当前没有需要完成的提醒"
-                    logger.info(f"[TodoList] No recent reminders found for user {user_id}")
+                    logger.info("[TodoList] No recent reminders found for user %s", user_id)
                     e_context["reply"] = reply
                     e_context.action = EventAction.BREAK_PASS
                     return
                 
-                # 批量完成这些待办
-                completed_count = 0
-                completed_titles = []
-                
-                for todo in recent_todos:
-                    ok, _ = complete_todo(user, todo.id)
-                    if ok:
-                        completed_count += 1
-                        completed_titles.append(todo.title)
+                # 批量完成这些待办：一条 UPDATE 完成，标题直接取自已查询的记录
+                completed_count = complete_todos_bulk(user, [todo.id for todo in recent_todos], session=s)
+                s.commit()
+                completed_titles = [todo.title for todo in recent_todos]
                 
                 if completed_count > 0:
                     reply.type = ReplyType.TEXT
@@ -220,20 +292,20 @@ class TodoListPlugin(Plugin):
                     else:
                         titles_str = "\n".join([f"  • {title}" for title in completed_titles])
                         reply.content = f"✅ 已批量完成 {completed_count} 个待办：\n{titles_str}"
-                    logger.info(f"[TodoList] Batch completed {completed_count} todos for user {user_id}: {completed_titles}")
+                    logger.info("[TodoList] Batch completed %s todos for user %s: %s", completed_count, user_id, completed_titles)
                     
                     e_context["reply"] = reply
                     e_context.action = EventAction.BREAK_PASS
                 else:
                     reply.type = ReplyType.TEXT
                     reply.content = "ℹ️ 没有找到可完成的提醒"
-                    logger.info(f"[TodoList] Found reminders but none completed for user {user_id}")
+                    logger.info("[TodoList] Found reminders but none completed for user %s", user_id)
                     e_context["reply"] = reply
                     e_context.action = EventAction.BREAK_PASS
                     return
                     
         except Exception as e:
-            logger.error(f"[TodoList] Batch complete error for user {user_id}: {e}")
+            logger.error("[TodoList] Batch complete error for user %s: %s", user_id, e)
             reply = Reply()
             reply.type = ReplyType.ERROR
             reply.content = "❌ 批量完成提醒失败，请稍后再试"
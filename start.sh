@@ -24,7 +24,7 @@ echo "[1/5] Initialize database and ensure schema..."
 $PY - <<'PY'
 from config import load_config
 from common.db import init_db, get_session
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 
 load_config()
 init_db()
@@ -42,6 +42,38 @@ with get_session() as s:
             print("✓ Column added: todos.repeat_rule")
         else:
             print(f"⚠ Schema check warning: {e}")
+
+    # expenses.amount 由 DECIMAL(元) 改为 INT(分)
+    try:
+        cols = {c["name"]: c for c in inspect(s.bind).get_columns("expenses")}
+        amount_type = str(cols["amount"]["type"]).upper() if "amount" in cols else ""
+        dialect = s.bind.dialect.name
+        if ("DECIMAL" in amount_type or "NUMERIC" in amount_type) and dialect in ("mysql", "postgresql"):
+            print("Migrating expenses.amount to integer cents ...")
+            if dialect == "mysql":
+                s.execute(text("ALTER TABLE expenses MODIFY amount DECIMAL(14,2) NOT NULL"))
+                s.execute(text("UPDATE expenses SET amount = amount * 100"))
+                s.execute(text("ALTER TABLE expenses MODIFY amount INT NOT NULL"))
+            else:
+                s.execute(text("ALTER TABLE expenses ALTER COLUMN amount TYPE INTEGER USING ROUND(amount * 100)"))
+            s.commit()
+            print("✓ Column migrated: expenses.amount (cents)")
+        elif "DECIMAL" in amount_type or "NUMERIC" in amount_type:
+            print(f"⚠ expenses.amount is still {amount_type}, please migrate it to integer cents manually")
+    except Exception as e:
+        print(f"⚠ Schema check warning: {e}")
+
+    # create_all 不会给已存在的表补建索引，这里单独检查
+    from common.models import Todo
+    for index in Todo.__table__.indexes:
+        if index.name not in ("idx_todos_due", "idx_todos_due_repeat", "idx_todos_user_remind",
+                              "idx_todos_user_last_remind"):
+            continue
+        try:
+            index.create(s.bind, checkfirst=True)
+            print(f"✓ Index OK: {index.name}")
+        except Exception as e:
+            print(f"⚠ Index check warning: {e}")
 PY
 
 echo
@@ -59,47 +91,29 @@ init_db()
 now = datetime.now()
 
 with get_session() as s:
-    # 1. 重置已过期但 reminded=True 的非重复任务
-    result1 = s.execute(
-        update(Todo).where(
-            Todo.status == "pending",
-            Todo.reminded == True,
-            Todo.remind_at != None,
-            Todo.remind_at < now,
-            Todo.repeat_rule == None
-        ).values(
-            reminded=False,
-            remind_count=0,
-            last_remind_at=None
-        )
-    )
-    count1 = result1.rowcount
-    
-    # 2. 重置重复任务的提醒状态
-    result2 = s.execute(
+    # 1. 重置已过期但 reminded=True 的任务（重复和非重复任务一并处理）
+    result = s.execute(
         update(Todo).where(
             Todo.status == "pending",
             Todo.reminded == True,
             Todo.remind_at != None,
             Todo.remind_at < now,
-            Todo.repeat_rule != None
         ).values(
             reminded=False,
             remind_count=0,
             last_remind_at=None
         )
     )
-    count2 = result2.rowcount
+    total_fixed = result.rowcount
     
     s.commit()
     
-    total_fixed = count1 + count2
     if total_fixed > 0:
-        print(f"✓ Fixed {total_fixed} reminder statuses (non-repeat: {count1}, repeat: {count2})")
+        print(f"✓ Fixed {total_fixed} reminder statuses")
     else:
         print("✓ No reminder status needs fixing")
     
-    # 3. 统计待提醒的待办
+    # 2. 统计待提醒的待办
     from sqlalchemy import select
     pending_todos = s.execute(
         select(Todo).where(
@@ -0,0 +1,43 @@
+# encoding:utf-8
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("requests")
+
+from common.service import _rule_parse_time  # noqa: E402
+
+# 2026-10-15 是周四
+NOW = datetime(2026, 10, 15, 10, 0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("明天下午3点开会", ("开会", datetime(2026, 10, 16, 15, 0))),
+    ("明天 下午3点开会", ("开会", datetime(2026, 10, 16, 15, 0))),
+    ("下周三 上午10点 面试", ("面试", datetime(2026, 10, 21, 10, 0))),
+    ("周五 下午提交报告", ("提交报告", datetime(2026, 10, 16, 15, 0))),
+    ("周五晚上8点半聚餐", ("聚餐", datetime(2026, 10, 16, 20, 30))),
+    ("今晚20:30 看电影", ("看电影", datetime(2026, 10, 15, 20, 30))),
+    ("开会 下午", ("开会", datetime(2026, 10, 15, 15, 0))),
+    ("晚上12点睡觉", ("睡觉", datetime(2026, 10, 16, 0, 0))),
+    ("今晚12点 睡觉", ("睡觉", datetime(2026, 10, 16, 0, 0))),
+])
+def test_rule_parse_time(text, expected):
+    assert _rule_parse_time(text, NOW) == expected
+
+
+@pytest.mark.parametrize("text", [
+    # 日期和时间不在同一处，交给 LLM
+    "明天开会 15:30",
+    # 非时间用法
+    "讨论第3点意见",
+    "3点开会",
+    "早上好",
+    "下午茶",
+    # 只有日期
+    "明天开会",
+])
+def test_rule_parse_time_defers_to_llm(text):
+    assert _rule_parse_time(text, NOW) is None
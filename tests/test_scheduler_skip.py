@@ -0,0 +1,69 @@
+# encoding:utf-8
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("requests")
+
+from common import scheduler  # noqa: E402
+from common.service import _mark_todos_changed  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def ticker(monkeypatch):
+    clock = _Clock()
+    calls = {"due": 0}
+    next_due = {"at": None}
+
+    def fetch_due(now, session=None):
+        calls["due"] += 1
+        return []
+
+    monkeypatch.setattr(scheduler.time, "monotonic", clock)
+    monkeypatch.setattr(scheduler, "fetch_due_reminders", fetch_due)
+    monkeypatch.setattr(scheduler, "fetch_next_due_at", lambda session=None: next_due["at"])
+    sch = scheduler.ReminderScheduler(lambda receiver, text: None)
+    sch._session = mock.Mock()
+    # 不真正排队，由测试逐轮调用并推进时钟
+    monkeypatch.setattr(sch, "_enter", lambda delay, action: None)
+
+    def tick():
+        sch._tick_reminders()
+        clock.now += sch.REMIND_INTERVAL
+
+    return tick, calls, next_due
+
+
+def test_idle_ticks_are_skipped(ticker):
+    tick, calls, _ = ticker
+    for _ in range(6):
+        tick()
+    # 每次查询后跳过一轮
+    assert calls["due"] == 3
+
+
+def test_change_invalidates_skip(ticker):
+    tick, calls, _ = ticker
+    tick()
+    _mark_todos_changed()
+    tick()
+    assert calls["due"] == 2
+
+
+def test_due_time_invalidates_skip(ticker):
+    tick, calls, next_due = ticker
+    next_due["at"] = datetime.now() - timedelta(seconds=1)
+    tick()
+    tick()
+    assert calls["due"] == 2
@@ -0,0 +1,29 @@
+# encoding:utf-8
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("bridge")
+
+from plugins.todolist.todolist import _split_command  # noqa: E402
+
+
+@pytest.mark.parametrize("text", [
+    "#todo",
+    "#todo done",
+    "#todo done 3",
+    "#todo  done 3 ",
+    "#todo done　3",  # 全角空格
+    "#todo list\tall",
+    "#todo 明天 下午3点 开会",
+    "#todolist all",
+])
+def test_split_command_matches_whitespace_split(text):
+    parts = text.split(None, 2)
+    expected = (parts[1] if len(parts) > 1 else "", parts[2] if len(parts) > 2 else "")
+    assert _split_command(text) == expected
+
+
+def test_split_command_full_width_and_tab():
+    assert _split_command("#todo done　3") == ("done", "3")
+    assert _split_command("#todo list\tall") == ("list", "all")
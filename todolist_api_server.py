@@ -8,16 +8,26 @@
 
 import web
 import os
+import gzip
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from datetime import datetime
 import json
 import openai
-from typing import Optional
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
 
 # 导入数据库相关
+from common import json_utils
+from common.log import logger
 from common.db import get_session, init_db
 from common.models import User, Todo
-from common.service import ensure_user, list_todos, complete_todo, delete_todo, create_todo, _parse_at, update_todo, undo_todo, reset_failed_todo
-from sqlalchemy import select
+from common.service import ensure_user, list_todos, get_todo, complete_todo, delete_todo, add_todo, _parse_at, update_todo, undo_todo, reset_failed_todo
+from sqlalchemy import select, update
 from config import load_config, conf
 
 # 加载配置并初始化数据库
@@ -47,45 +57,91 @@ urls = (
 
 
 # 辅助函数
+# 请求用户缓存：用户记录创建后基本不变，命中后无需每个请求都查询 users 表
+# 会话在 with 块结束时关闭，缓存的是已分离的 User 对象，可被各请求线程共享；按 LRU 限制条数
+_USER_CACHE_MAX = 256
+_user_cache: "OrderedDict[int, User]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+_first_user: Optional[User] = None
+
+
+def _cached_user(uid: int) -> Optional[User]:
+    with _user_cache_lock:
+        u = _user_cache.get(uid)
+        if u is not None:
+            _user_cache.move_to_end(uid)
+        return u
+
+
+def _cache_user(uid: int, u: User):
+    with _user_cache_lock:
+        _user_cache[uid] = u
+        _user_cache.move_to_end(uid)
+        while len(_user_cache) > _USER_CACHE_MAX:
+            _user_cache.popitem(last=False)
+
+
+def _query_params() -> dict:
+    """只解析查询串中的参数，代替 web.input()（后者还会读取并解析请求体、构建 Storage）"""
+    qs = web.ctx.env.get('QUERY_STRING')
+    return dict(parse_qsl(qs)) if qs else {}
+
+
 def _get_request_user(params: Optional[dict] = None) -> User:
     """根据请求参数获取用户，优先级：
     1) 显式传入 user_id/uid
     2) 数据库中的第一个用户（已有业务数据的用户）
     3) 回退到测试用户
     """
-    # 1) 显式 user_id/uid
+    global _first_user
+    # 1) 显式 user_id/uid（只缓存查到的用户，不存在的 id 之后可能由微信端创建）
     try:
         if params:
             uid = params.get("user_id") or params.get("uid")
             if uid:
-                with get_session() as s:
-                    u = s.execute(select(User).where(User.id == int(uid))).scalar_one_or_none()
+                uid = int(uid)
+                u = _cached_user(uid)
+                if u is None:
+                    with get_session() as s:
+                        u = s.execute(select(User).where(User.id == uid)).scalar_one_or_none()
                     if u:
-                        return u
+                        _cache_user(uid, u)
+                if u:
+                    return u
     except Exception:
         pass
 
-    # 2) 取已有的第一个用户（通常是微信端已有数据的用户）
-    with get_session() as s:
-        u = s.execute(select(User).order_by(User.id.asc()).limit(1)).scalar_one_or_none()
-        if u:
-            return u
+    if _first_user is None:
+        # 2) 取已有的第一个用户（通常是微信端已有数据的用户）
+        with get_session() as s:
+            u = s.execute(select(User).order_by(User.id.asc()).limit(1)).scalar_one_or_none()
+        # 3) 回退到测试用户（此时库中没有用户，新建的测试用户即为第一个用户）
+        _first_user = u or ensure_user("web_user_test", "Web用户")
+    return _first_user
+
+
+_HTTP_STATUS = {
+    400: '400 Bad Request',
+    404: '404 Not Found',
+    500: '500 Internal Server Error',
+}
+
 
-    # 3) 回退到测试用户
-    return ensure_user("web_user_test", "Web用户")
+def _json_response(obj) -> bytes:
+    """编码为 UTF-8 JSON 字节并设置 Content-Length，web.py 直接透传字节，无需再次编码"""
+    data = json_utils.dumps_bytes(obj)
+    web.header('Content-Length', str(len(data)))
+    return data
 
 
 def _set_status(code: int):
     try:
-        web.ctx.status = {
-            400: '400 Bad Request',
-            404: '404 Not Found',
-            500: '500 Internal Server Error',
-        }.get(code, '200 OK')
+        web.ctx.status = _HTTP_STATUS.get(code, '200 OK')
     except Exception:
         pass
 
 
+@lru_cache(maxsize=None)
 def _settings_file() -> str:
     current_dir = os.path.dirname(os.path.abspath(__file__))
     data_dir = os.path.join(current_dir, 'data')
@@ -97,26 +153,116 @@ def _settings_file() -> str:
     return os.path.join(data_dir, 'agent_prompts.json')
 
 
+# Agent 提示词缓存：(文件 mtime, 数据)，文件未被修改时直接返回内存中的数据
+_prompt_cache: tuple = (None, {})
+
+
 def _load_agent_prompt_map() -> dict:
+    """返回的字典与缓存共享，需要修改时请先复制"""
+    global _prompt_cache
     try:
         path = _settings_file()
-        if os.path.isfile(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f) or {}
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    cached_mtime, data = _prompt_cache
+    if mtime == cached_mtime:
+        return data
+    try:
+        with open(path, 'rb') as f:
+            data = json_utils.loads(f.read()) or {}
     except Exception:
-        pass
-    return {}
+        data = {}
+    _prompt_cache = (mtime, data)
+    return data
 
 
 def _save_agent_prompt_map(data: dict):
+    """先写临时文件再替换，写入成功后同步更新缓存"""
+    global _prompt_cache
     try:
         path = _settings_file()
-        with open(path, 'w', encoding='utf-8') as f:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        _prompt_cache = (os.stat(path).st_mtime, data)
     except Exception:
         pass
 
 
+# 标题中可能包含时间信息的字符/词（含 /at、/noremind 指令的斜杠），都不包含时无需解析，省去一次 LLM 调用
+# 宁可多匹配：误判只会多走一次解析，漏判才会丢失提醒时间
+_TIME_HINT_RE = re.compile(
+    r'[\d/:：零一二三四五六七八九十两半今明后昨早晚午夜凌周星礼拜点时分秒号日月年天前]'
+    r'|day|tonight|tomorrow|noon|morning|evening|night|week|month|hour|min|[ap]\.?m\b',
+    re.I,
+)
+
+
+# 拆分建议每行开头的数字序号（如 "1. " 或 "1、"）及需要去掉的列表符号
+_LEAD_NUM_RE = re.compile(r'^\d+[\.、]\s*')
+_STRIP_CHARS = "- •* \t\r"
+# 拆分建议最多返回的条数，流式读取时凑够即停止接收
+_MAX_SUGGESTIONS = 7
+
+# 拆分建议缓存：输入哈希 -> (过期时间, 结果)，相同待办重复拆分时不再调用 LLM
+_BREAKDOWN_TTL = 3600
+_BREAKDOWN_CACHE_MAX = 256
+_breakdown_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_breakdown_lock = threading.Lock()
+# 正在调用 LLM 的输入哈希 -> 完成事件，相同输入的并发请求等待同一次调用的结果
+_breakdown_inflight: Dict[str, threading.Event] = {}
+# 等待并发中的相同请求的最长时间（秒），略长于 LLM 请求超时
+_BREAKDOWN_WAIT = 35
+
+
+def _request_breakdown(title: str, note: Optional[str], override_agent_prompt: Optional[str], model: str) -> list:
+    """调用 LLM 生成拆分建议，流式读取并按行切分，凑够条数后关闭连接，不再等待剩余输出"""
+    base_system = (
+        "你是资深效率教练。按‘目标—步骤—验收’思路，把输入任务拆为3-7个"
+        "可执行子任务。输出简明中文条目，每条≤20字，可含估时(如20min)。"
+    )
+    system_prompt = base_system
+    if override_agent_prompt:
+        system_prompt = base_system + "\n补充写作风格/侧重点：" + override_agent_prompt
+    user_prompt = f"待办：{title}\n补充说明：{note or '无'}\n给出子任务清单。"
+    resp = openai.ChatCompletion.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        temperature=0.3,
+        max_tokens=300,
+        stream=True,
+        request_timeout=30,
+    )
+    suggestions = []
+
+    def add_line(line: str):
+        # 去掉开头的符号和数字序号，保留内容
+        line = _LEAD_NUM_RE.sub('', line.strip(_STRIP_CHARS))
+        if line:
+            suggestions.append(line)
+
+    buf = ''
+    for chunk in resp:
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if not delta:
+            continue
+        buf += delta
+        *lines, buf = buf.split('\n')
+        for line in lines:
+            add_line(line)
+        if len(suggestions) >= _MAX_SUGGESTIONS:
+            resp.close()
+            break
+    else:
+        add_line(buf)
+    return suggestions[:_MAX_SUGGESTIONS]
+
+
 def generate_breakdown_suggestions(title: str, note: Optional[str] = None, override_agent_prompt: Optional[str] = None) -> dict:
     """Use configured LLM API to generate breakdown suggestions and agent prompt.
     Returns a dict: { 'suggestions': [...], 'agent_prompt': '...' }
@@ -131,46 +277,47 @@ def generate_breakdown_suggestions(title: str, note: Optional[str] = None, overr
     }
 
     try:
-        api_key = conf().get("open_ai_api_key")
-        api_base = conf().get("open_ai_api_base")
-        model = conf().get("model") or "gpt-3.5-turbo"
+        cfg = conf()
+        api_key = cfg.get("open_ai_api_key")
         if not api_key:
             return default
-        openai.api_key = api_key
-        if api_base:
-            openai.api_base = api_base
-
-        base_system = (
-            "你是资深效率教练。按‘目标—步骤—验收’思路，把输入任务拆为3-7个"
-            "可执行子任务。输出简明中文条目，每条≤20字，可含估时(如20min)。"
-        )
-        system_prompt = base_system
-        if override_agent_prompt:
-            system_prompt = base_system + "\n补充写作风格/侧重点：" + override_agent_prompt
-        user_prompt = f"待办：{title}\n补充说明：{note or '无'}\n给出子任务清单。"
-        resp = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.3,
-            max_tokens=300,
-        )
-        content = resp["choices"][0]["message"]["content"].strip()
-        # Split lines to suggestions
-        suggestions = []
-        for line in content.splitlines():
-            # 去掉开头的符号和序号，保留内容
-            line = line.strip("- •* \t")
-            # 去掉开头的数字序号（如 "1. " 或 "1、" 等）
-            import re
-            line = re.sub(r'^\d+[\.、]\s*', '', line)
-            if line:
-                suggestions.append(line)
-        if not suggestions:
-            return default
-        return {"suggestions": suggestions[:7], "agent_prompt": override_agent_prompt or ""}
+        api_base = cfg.get("open_ai_api_base")
+        model = cfg.get("model") or "gpt-3.5-turbo"
+        cache_key = hashlib.sha1(f"{title}|{note}|{override_agent_prompt}|{model}".encode('utf-8')).hexdigest()
+        with _breakdown_lock:
+            hit = _breakdown_cache.get(cache_key)
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1]
+
+        # 相同输入已有请求在调用 LLM 时，等待它的结果而不重复发起调用
+        with _breakdown_lock:
+            waiter = _breakdown_inflight.get(cache_key)
+            if waiter is None:
+                _breakdown_inflight[cache_key] = threading.Event()
+        if waiter is not None:
+            waiter.wait(_BREAKDOWN_WAIT)
+            with _breakdown_lock:
+                hit = _breakdown_cache.get(cache_key)
+            return hit[1] if hit is not None else default
+
+        try:
+            openai.api_key = api_key
+            if api_base:
+                openai.api_base = api_base
+            suggestions = _request_breakdown(title, note, override_agent_prompt, model)
+            if not suggestions:
+                return default
+            result = {"suggestions": suggestions, "agent_prompt": override_agent_prompt or ""}
+            # 只缓存 LLM 的有效结果，失败时的默认建议不缓存，下次仍会重试
+            with _breakdown_lock:
+                _breakdown_cache[cache_key] = (time.monotonic() + _BREAKDOWN_TTL, result)
+                _breakdown_cache.move_to_end(cache_key)
+                while len(_breakdown_cache) > _BREAKDOWN_CACHE_MAX:
+                    _breakdown_cache.popitem(last=False)
+            return result
+        finally:
+            with _breakdown_lock:
+                _breakdown_inflight.pop(cache_key).set()
     except Exception:
         return default
 
@@ -191,6 +338,60 @@ def todo_to_dict(todo: Todo) -> dict:
     }
 
 
+# 待办序列化缓存：id -> (版本, JSON 片段)，行内容未变化时直接复用已编码的字节
+_ROW_CACHE_MAX = 2048
+_row_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_row_cache_lock = threading.Lock()
+
+
+def _todo_fragment(todo: Todo) -> bytes:
+    """返回单条待办的 JSON 字节片段（按可变字段判断是否需要重新编码）"""
+    ver = (todo.title, todo.note, todo.status, todo.due_at, todo.remind_at,
+           todo.repeat_rule, todo.reminded, todo.completed_at)
+    with _row_cache_lock:
+        hit = _row_cache.get(todo.id)
+        if hit is not None and hit[0] == ver:
+            _row_cache.move_to_end(todo.id)
+            return hit[1]
+    frag = json_utils.dumps_bytes(todo_to_dict(todo))
+    with _row_cache_lock:
+        _row_cache[todo.id] = (ver, frag)
+        _row_cache.move_to_end(todo.id)
+        while len(_row_cache) > _ROW_CACHE_MAX:
+            _row_cache.popitem(last=False)
+    return frag
+
+
+# 列表响应缓存：(user_id, status) -> (过期时间, JSON 字节)
+# 本进程内的写操作会立即失效对应用户的缓存；微信端和调度器在另一个进程中修改数据，依赖较短的 TTL 兜底
+_LIST_CACHE_TTL = 5
+_LIST_CACHE_MAX = 1024
+_list_cache: Dict[tuple, tuple] = {}
+_list_cache_lock = threading.Lock()
+
+
+def _list_cache_get(key: tuple) -> Optional[bytes]:
+    with _list_cache_lock:
+        hit = _list_cache.get(key)
+    if hit is not None and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _list_cache_put(key: tuple, body: bytes):
+    with _list_cache_lock:
+        if len(_list_cache) >= _LIST_CACHE_MAX:
+            _list_cache.clear()
+        _list_cache[key] = (time.monotonic() + _LIST_CACHE_TTL, body)
+
+
+def _invalidate_list_cache(user_id: int):
+    """待办发生变更后清除该用户的列表缓存"""
+    with _list_cache_lock:
+        for key in [k for k in _list_cache if k[0] == user_id]:
+            del _list_cache[key]
+
+
 # API Handlers
 class TodoListAPI:
     """GET /api/todos"""
@@ -200,20 +401,25 @@ class TodoListAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             
             status = params.get('status', 'pending')
             if status == 'all':
                 status = None
             
-            todos = list_todos(user, status=status, limit=100)
-            result = [todo_to_dict(t) for t in todos]
-            
-            return json.dumps(result, ensure_ascii=False)
+            key = (user.id, status)
+            body = _list_cache_get(key)
+            if body is None:
+                todos = list_todos(user, status=status, limit=100)
+                # 直接拼接各行缓存的 JSON 片段，未变化的行无需重新构建和编码
+                body = b'[' + b','.join(_todo_fragment(t) for t in todos) + b']'
+                _list_cache_put(key, body)
+            web.header('Content-Length', str(len(body)))
+            return body
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoCreateAPI:
@@ -226,19 +432,18 @@ class TodoCreateAPI:
             
             # 安全解析 JSON 数据
             raw_data = web.data()
-            print(f"[DEBUG] Raw data: {raw_data}")  # 调试信息
             if not raw_data:
                 _set_status(400)
-                return json.dumps({'error': 'Request body is empty'}, ensure_ascii=False)
+                return _json_response({'error': 'Request body is empty'})
             
             try:
-                data = json.loads(raw_data)
-                print(f"[DEBUG] Parsed data: {data}")  # 调试信息
+                data = json_utils.loads(raw_data)
+                logger.debug("[TodoAPI] Create request body: %s", data)
             except json.JSONDecodeError as e:
                 _set_status(400)
-                return json.dumps({'error': f'Invalid JSON: {str(e)}'}, ensure_ascii=False)
+                return _json_response({'error': f'Invalid JSON: {str(e)}'})
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             
             # 安全获取 title
@@ -247,10 +452,10 @@ class TodoCreateAPI:
                 title = (data.get('title') or '').strip()
             else:
                 _set_status(400)
-                return json.dumps({'error': 'Invalid request data format'}, ensure_ascii=False)
+                return _json_response({'error': 'Invalid request data format'})
             if not title:
                 _set_status(400)
-                return json.dumps({'error': 'Title is required'}, ensure_ascii=False)
+                return _json_response({'error': 'Title is required'})
             
             # 解析时间（显式传入）
             remind_time = None
@@ -263,7 +468,7 @@ class TodoCreateAPI:
             parsed_title = title
             parsed_remind_time = remind_time
             # 如果请求中未显式提供提醒时间，则尝试通过语义解析拆解标题
-            if parsed_remind_time is None:
+            if parsed_remind_time is None and _TIME_HINT_RE.search(title):
                 try:
                     body, parsed_time = _parse_at(title)
                     body = (body or '').strip()
@@ -273,42 +478,24 @@ class TodoCreateAPI:
                     if parsed_time:
                         parsed_remind_time = parsed_time
                 except Exception as e:
-                    print(f"[WARN] Semantic parse failed: {e}")
+                    logger.warning("[TodoAPI] Semantic parse failed: %s", e)
             
             # 获取重复规则
             repeat_rule = None
             if data.get('repeat_rule'):
                 repeat_rule = data.get('repeat_rule').strip() or None
             
-            # 调用 service 创建，暂时先不传 repeat_rule（后续扩展）
-            ok, result = create_todo(user, parsed_title, parsed_remind_time)
-            
-            # 如果创建成功且有 repeat_rule，更新数据库
-            if ok and repeat_rule:
-                from common.db import get_session
-                from common.models import Todo
-                from sqlalchemy import select, update
-                with get_session() as s:
-                    # 找到刚创建的 todo
-                    stmt = select(Todo).where(Todo.user_id == user.id).order_by(Todo.id.desc()).limit(1)
-                    todo = s.execute(stmt).scalar_one_or_none()
-                    if todo:
-                        s.execute(update(Todo).where(Todo.id == todo.id).values(repeat_rule=repeat_rule))
-                        s.commit()
-            
-            if ok:
-                # 返回最新创建的待办
-                todos = list_todos(user, limit=1)
-                if todos:
-                    return json.dumps(todo_to_dict(todos[0]), ensure_ascii=False)
-                return json.dumps({'message': result}, ensure_ascii=False)
-            else:
+            # 一次 INSERT 写入标题、提醒时间和重复规则，直接返回新建的待办
+            todo = add_todo(user, parsed_title, parsed_remind_time, repeat_rule=repeat_rule)
+            if todo is None:
                 _set_status(400)
-                return json.dumps({'error': result}, ensure_ascii=False)
+                return _json_response({'error': '待办内容不能为空。'})
+            _invalidate_list_cache(user.id)
+            return _json_response(todo_to_dict(todo))
                 
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoItemAPI:
@@ -319,19 +506,18 @@ class TodoItemAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            todos = list_todos(user, limit=100)
-            todo = next((t for t in todos if t.id == int(todo_id)), None)
+            todo = get_todo(user, int(todo_id))
             
             if not todo:
                 _set_status(404)
-                return json.dumps({'error': 'Todo not found'}, ensure_ascii=False)
+                return _json_response({'error': 'Todo not found'})
             
-            return json.dumps(todo_to_dict(todo), ensure_ascii=False)
+            return _json_response(todo_to_dict(todo))
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
     
     def POST(self, todo_id):
         """更新待办（目前主要用于更新 repeat_rule）"""
@@ -339,34 +525,37 @@ class TodoItemAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            data = json.loads(web.data() or '{}')
-            
-            from common.db import get_session
-            from common.models import Todo
-            from sqlalchemy import select, update
-            
-            with get_session() as s:
-                # 验证待办属于该用户
-                todo = s.execute(select(Todo).where(Todo.id == int(todo_id), Todo.user_id == user.id)).scalar_one_or_none()
-                if not todo:
-                    _set_status(404)
-                    return json.dumps({'error': 'Todo not found'}, ensure_ascii=False)
-                
-                # 更新字段
-                update_data = {}
-                if 'repeat_rule' in data:
-                    update_data['repeat_rule'] = data['repeat_rule'] or None
-                
-                if update_data:
-                    s.execute(update(Todo).where(Todo.id == int(todo_id)).values(**update_data))
+            data = json_utils.loads(web.data() or b'{}')
+            
+            # 更新字段
+            update_data = {}
+            if 'repeat_rule' in data:
+                update_data['repeat_rule'] = data['repeat_rule'] or None
+            
+            if update_data:
+                with get_session() as s:
+                    # 条件中带上 user_id，归属校验和更新合并为一条 UPDATE
+                    result = s.execute(
+                        update(Todo)
+                        .where(Todo.id == int(todo_id), Todo.user_id == user.id)
+                        .values(**update_data)
+                    )
                     s.commit()
-                
-                return json.dumps({'message': '更新成功', 'todo_id': int(todo_id)}, ensure_ascii=False)
+                found = result.rowcount > 0
+                if found:
+                    _invalidate_list_cache(user.id)
+            else:
+                found = get_todo(user, int(todo_id)) is not None
+            
+            if not found:
+                _set_status(404)
+                return _json_response({'error': 'Todo not found'})
+            return _json_response({'message': '更新成功', 'todo_id': int(todo_id)})
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoRemindAPI:
@@ -381,32 +570,30 @@ class TodoRemindAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
 
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            todos = list_todos(user, limit=100)
-            todo = next((t for t in todos if t.id == int(todo_id)), None)
+            todo = get_todo(user, int(todo_id))
             if not todo:
                 _set_status(404)
-                return json.dumps({'error': 'Todo not found'}, ensure_ascii=False)
-            return json.dumps({'todo_id': todo.id, 'remind_at': todo.remind_at.isoformat() if todo.remind_at else None}, ensure_ascii=False)
+                return _json_response({'error': 'Todo not found'})
+            return _json_response({'todo_id': todo.id, 'remind_at': todo.remind_at.isoformat() if todo.remind_at else None})
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
     def PUT(self, todo_id):
         try:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
 
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            todos = list_todos(user, limit=100)
-            todo = next((t for t in todos if t.id == int(todo_id)), None)
+            todo = get_todo(user, int(todo_id))
             if not todo:
                 _set_status(404)
-                return json.dumps({'error': 'Todo not found'}, ensure_ascii=False)
+                return _json_response({'error': 'Todo not found'})
 
-            data = json.loads(web.data() or '{}')
+            data = json_utils.loads(web.data() or b'{}')
             value = (data.get('remind_at') or '').strip()
 
             # 解析时间
@@ -419,41 +606,42 @@ class TodoRemindAPI:
                         new_time = datetime.strptime(value, '%Y-%m-%d %H:%M')
                 except Exception:
                     _set_status(400)
-                    return json.dumps({'error': 'Invalid time format'}, ensure_ascii=False)
+                    return _json_response({'error': 'Invalid time format'})
 
             # 更新
             from common.service import edit_todo
             ok, msg = edit_todo(user, todo.id, new_time=new_time)
+            _invalidate_list_cache(user.id)
             if ok:
-                return json.dumps({'message': msg, 'remind_at': new_time.isoformat() if new_time else None}, ensure_ascii=False)
+                return _json_response({'message': msg, 'remind_at': new_time.isoformat() if new_time else None})
             _set_status(400)
-            return json.dumps({'error': msg}, ensure_ascii=False)
+            return _json_response({'error': msg})
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
     def DELETE(self, todo_id):
         try:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
 
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            todos = list_todos(user, limit=100)
-            todo = next((t for t in todos if t.id == int(todo_id)), None)
+            todo = get_todo(user, int(todo_id))
             if not todo:
                 _set_status(404)
-                return json.dumps({'error': 'Todo not found'}, ensure_ascii=False)
+                return _json_response({'error': 'Todo not found'})
 
             from common.service import edit_todo
             ok, msg = edit_todo(user, todo.id, clear_remind=True)
+            _invalidate_list_cache(user.id)
             if ok:
-                return json.dumps({'message': msg, 'remind_at': None}, ensure_ascii=False)
+                return _json_response({'message': msg, 'remind_at': None})
             _set_status(400)
-            return json.dumps({'error': msg}, ensure_ascii=False)
+            return _json_response({'error': msg})
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 class TodoCompleteAPI:
     """POST /api/todos/<id>/complete"""
@@ -463,18 +651,19 @@ class TodoCompleteAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             ok, result = complete_todo(user, int(todo_id))
+            _invalidate_list_cache(user.id)
             
             if ok:
-                return json.dumps({'message': result}, ensure_ascii=False)
+                return _json_response({'message': result})
             else:
                 _set_status(400)
-                return json.dumps({'error': result}, ensure_ascii=False)
+                return _json_response({'error': result})
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoDeleteAPI:
@@ -485,18 +674,19 @@ class TodoDeleteAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             ok, result = delete_todo(user, int(todo_id))
+            _invalidate_list_cache(user.id)
             
             if ok:
-                return json.dumps({'message': result}, ensure_ascii=False)
+                return _json_response({'message': result})
             else:
                 _set_status(400)
-                return json.dumps({'error': result}, ensure_ascii=False)
+                return _json_response({'error': result})
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoBreakdownAPI:
@@ -507,19 +697,18 @@ class TodoBreakdownAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            todos = list_todos(user, limit=100)
-            todo = next((t for t in todos if t.id == int(todo_id)), None)
+            todo = get_todo(user, int(todo_id))
             
             if not todo:
                 _set_status(404)
-                return json.dumps({'error': 'Todo not found'}, ensure_ascii=False)
+                return _json_response({'error': 'Todo not found'})
             
             # 解析可选自定义 agent 提示词（JSON body）
             try:
                 raw = web.data()
-                payload = json.loads(raw) if raw else {}
+                payload = json_utils.loads(raw) if raw else {}
             except Exception:
                 payload = {}
             override_prompt = payload.get('agent_prompt') or payload.get('prompt') if isinstance(payload, dict) else None
@@ -527,16 +716,16 @@ class TodoBreakdownAPI:
             gen = generate_breakdown_suggestions(todo.title, todo.note, override_agent_prompt=override_prompt)
             
             # 只返回建议，不返回 agent_prompt
-            return json.dumps({
+            return _json_response({
                 'todo_id': todo.id,
                 'todo_title': todo.title,
                 'suggestions': gen.get('suggestions', []),
                 'note': 'AI生成建议（不入库），仅供参考'
-            }, ensure_ascii=False)
+            })
             
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoUpdateAPI:
@@ -547,11 +736,11 @@ class TodoUpdateAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             
             # 解析请求体
-            data = json.loads(web.data() or '{}')
+            data = json_utils.loads(web.data() or b'{}')
             title = data.get('title', '').strip() if data.get('title') else None
             time_str = data.get('remind_at')
             repeat_rule = data.get('repeat_rule', '') if data.get('repeat_rule') else None
@@ -565,19 +754,20 @@ class TodoUpdateAPI:
                     else:
                         remind_at = datetime.strptime(time_str, '%Y-%m-%dT%H:%M')
                 except Exception as e:
-                    print(f"Parse time error: {e}")
+                    logger.warning("[TodoAPI] Parse time error: %s", e)
             
             ok, result = update_todo(user, int(todo_id), title=title, remind_at=remind_at, repeat_rule=repeat_rule)
+            _invalidate_list_cache(user.id)
             
             if ok:
-                return json.dumps({'message': result}, ensure_ascii=False)
+                return _json_response({'message': result})
             else:
                 _set_status(400)
-                return json.dumps({'error': result}, ensure_ascii=False)
+                return _json_response({'error': result})
                 
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoUndoAPI:
@@ -588,20 +778,21 @@ class TodoUndoAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             
             ok, result = undo_todo(user, int(todo_id))
+            _invalidate_list_cache(user.id)
             
             if ok:
-                return json.dumps({'message': result}, ensure_ascii=False)
+                return _json_response({'message': result})
             else:
                 _set_status(400)
-                return json.dumps({'error': result}, ensure_ascii=False)
+                return _json_response({'error': result})
                 
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class TodoResetAPI:
@@ -612,20 +803,21 @@ class TodoResetAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
             
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             
             ok, result = reset_failed_todo(user, int(todo_id))
+            _invalidate_list_cache(user.id)
             
             if ok:
-                return json.dumps({'message': result}, ensure_ascii=False)
+                return _json_response({'message': result})
             else:
                 _set_status(400)
-                return json.dumps({'error': result}, ensure_ascii=False)
+                return _json_response({'error': result})
                 
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class AgentPromptAPI:
@@ -640,31 +832,31 @@ class AgentPromptAPI:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
 
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
             store = _load_agent_prompt_map()
             prompt = store.get(str(user.id)) or ''
-            return json.dumps({ 'user_id': user.id, 'agent_prompt': prompt }, ensure_ascii=False)
+            return _json_response({ 'user_id': user.id, 'agent_prompt': prompt })
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
     def POST(self):
         try:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
 
-            params = web.input()
+            params = _query_params()
             user = _get_request_user(params)
-            body = json.loads(web.data() or '{}')
+            body = json_utils.loads(web.data() or b'{}')
             prompt = (body.get('agent_prompt') or '').strip()
-            store = _load_agent_prompt_map()
+            store = dict(_load_agent_prompt_map())
             store[str(user.id)] = prompt
             _save_agent_prompt_map(store)
-            return json.dumps({ 'user_id': user.id, 'agent_prompt': prompt }, ensure_ascii=False)
+            return _json_response({ 'user_id': user.id, 'agent_prompt': prompt })
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
 
 class APIBalanceAPI:
@@ -683,23 +875,23 @@ class APIBalanceAPI:
             
             # 获取Web展示数据
             data = balance_service.get_balance_for_web()
-            return json.dumps(data, ensure_ascii=False)
+            return _json_response(data)
             
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
 
     def POST(self):
         try:
             web.header('Content-Type', 'application/json')
             web.header('Access-Control-Allow-Origin', '*')
 
-            body = json.loads(web.data() or '{}')
+            body = json_utils.loads(web.data() or b'{}')
             api_key = body.get('api_key', '').strip()
             
             if not api_key:
                 _set_status(400)
-                return json.dumps({'error': 'API KEY不能为空'}, ensure_ascii=False)
+                return _json_response({'error': 'API KEY不能为空'})
             
             from common.api_balance_service import get_balance_service
             balance_service = get_balance_service()
@@ -708,21 +900,36 @@ class APIBalanceAPI:
             result = balance_service.update_api_key(api_key)
             
             if result['success']:
-                return json.dumps({
+                return _json_response({
                     'success': True,
                     'message': result['message'],
                     'balance': result.get('balance', 0)
-                }, ensure_ascii=False)
+                })
             else:
                 _set_status(400)
-                return json.dumps({
+                return _json_response({
                     'success': False,
                     'error': result['message']
-                }, ensure_ascii=False)
+                })
                 
         except Exception as e:
             _set_status(500)
-            return json.dumps({'error': str(e)}, ensure_ascii=False)
+            return _json_response({'error': str(e)})
+
+
+# 前端页面：首次请求时读入内存并预先 gzip 压缩，页面在进程生命周期内不变
+_PAGE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'channel', 'web', 'todolist.html')
+_page_cache: Optional[tuple] = None
+
+
+def _load_page() -> tuple:
+    """返回 (原始页面字节, gzip 压缩后的字节)"""
+    global _page_cache
+    if _page_cache is None:
+        with open(_PAGE_FILE, 'rb') as f:
+            html = f.read()
+        _page_cache = (html, gzip.compress(html, 6))
+    return _page_cache
 
 
 class TodoListPage:
@@ -730,12 +937,21 @@ class TodoListPage:
     
     def GET(self):
         try:
-            import os
-            file_path = os.path.join(os.path.dirname(__file__), 'channel/web/todolist.html')
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            html, html_gz = _load_page()
         except Exception as e:
             return f"Error loading page: {e}"
+        web.header('Content-Type', 'text/html; charset=utf-8')
+        web.header('Cache-Control', 'public, max-age=60')
+        web.header('Vary', 'Accept-Encoding')
+        if 'gzip' in web.ctx.env.get('HTTP_ACCEPT_ENCODING', ''):
+            web.header('Content-Encoding', 'gzip')
+            return html_gz
+        return html
+
+
+# 模块级 WSGI 入口：既可用内置服务器启动，也可交给 gunicorn/waitress 等托管（todolist_api_server:application）
+app = web.application(urls, globals())
+application = app.wsgifunc()
 
 
 if __name__ == '__main__':
@@ -764,6 +980,5 @@ if __name__ == '__main__':
     print("=" * 60)
     print("")
     
-    app = web.application(urls, globals())
-    web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", 9900))
+    web.httpserver.runsimple(application, ("0.0.0.0", 9900))
 